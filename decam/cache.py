@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+@author: efourrier
+
+Purpose : Caching of the results of the DataCleaner class.
+- memoized keeps the results in memory per method and normalized arguments
+until the data changes.
+- DiskCache and disk_cached persist the results on disk keyed by a
+fingerprint of the data and the parameters of the call, so unchanged data is
+not audited twice across sessions.
+
+"""
+
+import os
+import copy
+import inspect
+import hashlib
+import pickle
+import tempfile
+from functools import wraps
+
+
+class DiskCache(object):
+    """
+    Directory of pickled results with a size based LRU eviction : when the
+    total size of the files is above max_size (in bytes) the least recently
+    used results are deleted.
+
+    Parameters
+    ----------
+    cache_dir : the directory of the cache, created if needed
+    max_size : the max size of the cache in bytes, default 1GB
+
+    Examples
+    --------
+    * cache = DiskCache('/tmp/decam_cache')
+    * cache.set('my_key', result)
+    * found, result = cache.get('my_key')
+    """
+
+    suffix = '.pkl'
+
+    def __init__(self, cache_dir, max_size=1e9):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, key):
+        name = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name + self.suffix)
+
+    def get(self, key):
+        """ Return a tuple (found, value) for the key """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        # mark the result as recently used
+        os.utime(path, None)
+        return True, value
+
+    def set(self, key, value):
+        """ Store the value for the key and evict the old results if needed """
+        handle, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        with os.fdopen(handle, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+        self.evict()
+
+    def files(self):
+        """ Return the list of (last use time, size, path) of the cached results
+        sorted from the least recently used """
+        res = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                res.append((stat.st_mtime, stat.st_size, path))
+        return sorted(res)
+
+    def size(self):
+        """ Return the total size of the cached results in bytes """
+        return sum(size for _, size, _ in self.files())
+
+    def evict(self):
+        """ Delete the least recently used results until the size of the cache
+        is under max_size """
+        files = self.files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """ Delete all the cached results """
+        for _, _, path in self.files():
+            os.remove(path)
+
+
+# arguments changing how a result is computed but not the result itself
+EXECUTION_PARAMS = ('n_jobs', 'block_size', 'memmap_dir',
+                    'partition_dir', 'nb_partitions')
+
+
+def normalize_value(value):
+    """ Return a representation of an argument independent of the order of
+    the keys of dictionnaries """
+    if isinstance(value, dict):
+        return '{' + ', '.join('{0!r}: {1}'.format(k, normalize_value(v))
+                               for k, v in sorted(value.items())) + '}'
+    return repr(value)
+
+
+def call_key(method, instance, args, kwargs):
+    """ Return a string identifying a call of a method : the name of the
+    method and all its arguments (defaults included) sorted by name, the
+    arguments of EXECUTION_PARAMS are ignored """
+    method = getattr(method, 'method', method)
+    callargs = inspect.getcallargs(method, instance, *args, **kwargs)
+    params = [(name, value) for name, value in sorted(callargs.items())
+              if value is not instance and name not in EXECUTION_PARAMS]
+    return '{0}({1})'.format(method.__name__, ', '.join(
+        '{0}={1}'.format(name, normalize_value(value)) for name, value in params))
+
+
+def memoized(method):
+    """ Decorator of DataCleaner methods keeping their results in memory,
+    keyed by the name of the method and its normalized arguments.
+    The results are dropped (invalidate) when the data attribute is assigned
+    or reshaped, methods mutating the data in place should call invalidate.
+    A copy of the result is returned, so the caller can modify it without
+    changing the memoized result """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._memo_shape != self.data.shape:
+            self.invalidate()
+        key = call_key(method, self, args, kwargs)
+        if key not in self._memo:
+            self._memo[key] = method(self, *args, **kwargs)
+        return copy.deepcopy(self._memo[key])
+    wrapper.method = getattr(method, 'method', method)
+    return wrapper
+
+
+def disk_cached(method):
+    """ Decorator of DataCleaner methods persisting their results in the disk
+    cache of the instance (if any) keyed by the fingerprint of the data and the
+    parameters of the call """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._disk_cache is None:
+            return method(self, *args, **kwargs)
+        key = '{0}|{1}'.format(self.fingerprint(), call_key(method, self, args, kwargs))
+        found, value = self._disk_cache.get(key)
+        if found:
+            return value
+        value = method(self, *args, **kwargs)
+        self._disk_cache.set(key, value)
+        return value
+    wrapper.method = getattr(method, 'method', method)
+    return wrapper
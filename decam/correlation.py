@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+@author: efourrier
+
+Purpose : Correlation helpers used by the DataCleaner and FeatureImportance
+classes, relying on numpy arrays instead of pandas DataFrame operations.
+
+"""
+
+import os
+import tempfile
+import pandas as pd
+import numpy as np
+
+
+def _row_blocks(n, block_size):
+    return [slice(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+
+
+def _float_rows(data, rows, positions=None):
+    """ float array of a block of rows of an array or of the columns at
+    positions of a DataFrame """
+    if isinstance(data, pd.DataFrame):
+        return data.iloc[rows, positions].astype(float).values
+    return np.asarray(data[rows], dtype=float)
+
+
+def _rank_array(df, positions, memmap_dir=None):
+    """ Ranks of the columns of df at positions (average method, missing
+    values kept) in a float array, a memory mapped file of memmap_dir if
+    memmap_dir is not None. The columns are ranked one by one so no ranked
+    copy of the DataFrame is built """
+    n, p = len(df.index), len(positions)
+    if memmap_dir is None:
+        x = np.empty((n, p), dtype=float)
+    else:
+        handle, path = tempfile.mkstemp(suffix='.dat', dir=memmap_dir)
+        os.close(handle)
+        x = np.memmap(path, dtype=float, mode='w+', shape=(n, p))
+    for j in range(p):
+        x[:, j] = df.iloc[:, positions[j]].rank().values
+    return x
+
+
+def _column_means(data, positions, block_size):
+    """ Return the means and the numbers of non missing values of the columns,
+    reading the data by blocks of rows """
+    n, p = len(data), len(positions)
+    sums = np.zeros(p)
+    counts = np.zeros(p)
+    for rows in _row_blocks(n, block_size):
+        xb = _float_rows(data, rows, positions)
+        notnull = ~np.isnan(xb)
+        sums += np.where(notnull, xb, 0).sum(axis=0)
+        counts += notnull.sum(axis=0)
+    return sums / np.maximum(counts, 1), counts
+
+
+def _pearson_complete(data, positions, means, block_size):
+    """ Pearson correlation of data without missing values : the products of
+    the centered blocks of rows are summed, each block is read and centered
+    once """
+    n, p = len(data), len(positions)
+    sxy = np.zeros((p, p))
+    sxx_raw = np.zeros(p)
+    for rows in _row_blocks(n, block_size):
+        xb = _float_rows(data, rows, positions)
+        sxx_raw += (xb ** 2).sum(axis=0)
+        xb -= means
+        sxy += np.dot(xb.T, xb)
+    var = np.diag(sxy).copy()
+    # constant columns have no correlation
+    var[var <= 1e-12 * sxx_raw] = np.nan
+    std = np.sqrt(var)
+    with np.errstate(invalid='ignore'):
+        return np.clip(sxy / np.outer(std, std), -1, 1)
+
+
+def _pearson_pairwise(data, positions, means, block_size):
+    """ Pearson correlation of data with missing values, using the pairwise
+    complete observations like pandas : the products of the centered values
+    and of the masks of non missing values of each block of rows (prepared
+    once) are summed """
+    n, p = len(data), len(positions)
+    nb = np.zeros((p, p))
+    sx = np.zeros((p, p))
+    sxx = np.zeros((p, p))
+    sxy = np.zeros((p, p))
+    for rows in _row_blocks(n, block_size):
+        xb = _float_rows(data, rows, positions) - means
+        mb = (~np.isnan(xb)).astype(float)
+        x0 = np.where(mb > 0, xb, 0)
+        nb += np.dot(mb.T, mb)
+        sx += np.dot(x0.T, mb)
+        sxx += np.dot((x0 ** 2).T, mb)
+        sxy += np.dot(x0.T, x0)
+    # sums of the second column of each pair on the rows where both are known
+    sy, syy = sx.T, sxx.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sy / nb
+        var_x = sxx - sx ** 2 / nb
+        var_y = syy - sy ** 2 / nb
+        r = cov / np.sqrt(var_x * var_y)
+    # no correlation for constant pairs or less than 2 observations
+    r[(nb < 2) | (var_x <= 1e-12 * sxx) | (var_y <= 1e-12 * syy)] = np.nan
+    return np.clip(r, -1, 1)
+
+
+def corr_matrix(df, method='pearson', block_size=10000, memmap_dir=None, columns=None):
+    """
+    Correlation matrix of the columns of a numeric DataFrame, scaling to tall
+    and wide tables.
+
+    The data is read by blocks of block_size rows, twice : once for the means
+    of the columns, once to sum the products of the centered blocks (and of
+    the masks of non missing values to keep the pairwise complete observations
+    of pandas when there are missing values). Each block is converted and
+    prepared once, so the memory used is a few blocks of rows and the p x p
+    sums, without a working copy of the data. The spearman correlation is the
+    pearson correlation of the ranks computed once per column (pandas ranks
+    again on each pair when there are missing values), the ranks are the only
+    copy of the data and can be stored in a memory mapped file.
+
+    Arguments
+    ---------
+    df : a numeric pandas DataFrame
+    method : 'pearson', 'spearman' or 'kendall' (delegated to pandas)
+    block_size : number of rows per block
+    memmap_dir : if not None, the ranks of spearman are stored in a memory
+    mapped file of this directory instead of the RAM
+    columns : the columns of df to correlate, default None (all the columns)
+
+    Returns
+    -------
+    the correlation matrix as a pandas DataFrame
+    """
+    columns = df.columns if columns is None else pd.Index(columns)
+    if method == 'kendall':
+        return df.loc[:, columns].corr(method='kendall')
+    if method not in ('pearson', 'spearman'):
+        raise ValueError("method should be 'pearson', 'spearman' or 'kendall'")
+    positions = df.columns.get_indexer(columns)
+    if method == 'spearman':
+        data = _rank_array(df, positions, memmap_dir=memmap_dir)
+        positions = np.arange(len(positions))
+    else:
+        data = df
+    try:
+        means, counts = _column_means(data, positions, block_size)
+        if (counts < len(df.index)).any():
+            res = _pearson_pairwise(data, positions, means, block_size)
+        else:
+            res = _pearson_complete(data, positions, means, block_size)
+    finally:
+        if isinstance(data, np.memmap):
+            path = data.filename
+            del data
+            os.remove(path)
+    diag = np.arange(len(res))
+    res[diag, diag] = np.where(np.isnan(res[diag, diag]), np.nan, 1.0)
+    return pd.DataFrame(res, index=columns, columns=columns)
+
+
+def recursive_pairwise_elimination(cor, cutoff=.90, absolute=False, print_mode=False):
+    """
+    Recursive Pairwise Elimination on a correlation matrix.
+
+    The function finds the highest correlated pair and removes the feature of
+    the pair with the highest mean correlation, then repeats the process until
+    the threshold 'cutoff' is reached (adaptation of 'findCorrelation' in the
+    caret package in R).
+
+    The matrix is kept as a numpy array with a mask of the remaining features,
+    and the sum, the count and the max of each column are updated after each
+    elimination instead of being recomputed on the whole matrix.
+
+    Arguments
+    ---------
+    cor : a pandas DataFrame correlation matrix
+    cutoff : correlation cutoff to stop the algorithm
+    absolute : use the absolute values of the correlations like caret does,
+    default False
+    print_mode : print the max correlation at each step
+
+    Returns
+    -------
+    the list of the features to remove
+    """
+    names = list(cor.columns)
+    c = np.array(cor.values, dtype=float)
+    if absolute:
+        c = np.absolute(c)
+    np.fill_diagonal(c, 0)
+    p = len(names)
+    if p == 0:
+        return []
+    notnull = ~np.isnan(c)
+    alive = np.ones(p, dtype=bool)
+    col_sum = np.where(notnull, c, 0).sum(axis=0)
+    col_count = notnull.sum(axis=0)
+    c_max = np.where(notnull, c, -np.inf)
+    col_argmax = c_max.argmax(axis=0)
+    col_max = c_max[col_argmax, np.arange(p)]
+
+    def best():
+        # first remaining feature with the highest max, nan if there is none
+        a = col_max.argmax()
+        return a, (col_max[a] if col_max[a] > -np.inf else np.nan)
+
+    res = []
+    a, max_cor = best()
+    if print_mode:
+        print(max_cor)
+    while max_cor > cutoff:
+        b = col_argmax[a]
+        if col_sum[a] / col_count[a] > col_sum[b] / col_count[b]:
+            drop = a
+        else:
+            drop = b
+        res.append(names[drop])
+        alive[drop] = False
+        # update the bookkeeping of the remaining columns
+        col_sum -= np.where(notnull[drop], c[drop], 0)
+        col_count -= notnull[drop]
+        c_max[drop, :] = -np.inf
+        c_max[:, drop] = -np.inf
+        col_max[drop] = -np.inf
+        to_update = np.where(alive & (col_argmax == drop))[0]
+        if len(to_update):
+            col_argmax[to_update] = c_max[:, to_update].argmax(axis=0)
+            col_max[to_update] = c_max[col_argmax[to_update], to_update]
+        a, max_cor = best()
+        if print_mode:
+            print(max_cor)
+    return res
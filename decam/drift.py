@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+@author: efourrier
+
+Purpose : Monitoring of the drift of the distribution of the columns of new
+data compared to a benchmark with the Population Stability Index (psi), the
+bins of each column being fitted once on the benchmark.
+
+"""
+
+import pandas as pd
+import numpy as np
+
+
+def nearest_percentiles(values, q):
+    """ np.percentile with the 'nearest' method (interpolation argument of
+    the old numpy versions) """
+    try:
+        return np.percentile(values, q, method='nearest')
+    except TypeError:
+        return np.percentile(values, q, interpolation='nearest')
+
+
+def psi_from_pct(bench_pct, target_pct):
+    """ Population Stability Index between two arrays of bin proportions, the
+    bins empty in both arrays are ignored """
+    used = (bench_pct > 0) | (target_pct > 0)
+    bench_pct, target_pct = bench_pct[used], target_pct[used]
+    with np.errstate(divide='ignore'):
+        return np.sum((target_pct - bench_pct) * np.log(target_pct / bench_pct))
+
+
+class DriftMonitor(object):
+    """
+    Population Stability Index monitoring of all the columns of new
+    DataFrames (or of a stream of chunks) against a benchmark DataFrame.
+
+    The bins are fitted once per column on the benchmark like utils.psi : the
+    unique values of group + 1 percentiles (nearest method) for the numeric
+    columns, the right closed intervals between them being the bins, the
+    values below or above the benchmark range going to the first or last bin.
+    Every level of the benchmark is a bin of the other columns, the unseen
+    levels sharing one more bin. The missing values have their own bin.
+    The bins of a column are counted with one np.searchsorted (or
+    Index.get_indexer) and one np.bincount, and the proportions are smoothed
+    with a pseudo count per bin so an empty bin does not give an infinite psi.
+
+    Parameters
+    ----------
+    group : the number of percentile bins of the numeric columns, default 10
+    columns : the columns to monitor, default None (all the columns)
+    smoothing : pseudo count added to each bin, default 0.5
+
+    Examples
+    --------
+    * monitor = DriftMonitor(group = 10).fit(bench_df)
+    * monitor.psi(new_df) : Series of the psi of each column
+    * monitor.psi(chunks) : psi of the rows of an iterable of DataFrames
+    * monitor.report(new_df, 'income') : proportions per bin of a column
+    * accumulator = monitor.accumulator() : incremental psi of a stream
+    """
+
+    def __init__(self, group=10, columns=None, smoothing=0.5):
+        self.group = group
+        self.columns = None if columns is None else list(columns)
+        self.smoothing = smoothing
+        self.edges_ = {}
+        self.levels_ = {}
+        self.bench_counts_ = {}
+
+    def fit(self, bench):
+        """ Fit the bins of the columns and count the benchmark rows per bin """
+        if self.columns is None:
+            self.columns = list(bench.columns)
+        q = [(100.0 / self.group) * i for i in range(self.group + 1)]
+        for col in self.columns:
+            serie = bench[col]
+            if serie.dtype.kind in 'biuf':
+                values = serie.values.astype(float)
+                values = values[~np.isnan(values)]
+                self.edges_[col] = np.unique(nearest_percentiles(values, q)) if len(values) \
+                    else np.array([0.0])
+            else:
+                levels = pd.unique(serie.dropna().values)
+                try:
+                    levels = np.sort(levels)
+                except TypeError:
+                    # not comparable values are kept in order of appearance
+                    pass
+                self.levels_[col] = pd.Index(levels)
+        self.bench_counts_ = self.bin_counts(bench)
+        return self
+
+    def nb_bins(self, col):
+        """ number of bins of a column (missing values bin included) """
+        if col in self.edges_:
+            return max(len(self.edges_[col]) - 1, 1) + 1
+        return len(self.levels_[col]) + 2
+
+    def bin_labels(self, col):
+        """ labels of the bins of a column """
+        if col in self.edges_:
+            edges = self.edges_[col]
+            if len(edges) < 2:
+                labels = ['[{0}, {0}]'.format(edges[0])]
+            else:
+                labels = ['({0}, {1}]'.format(low, high) for low, high in zip(edges[:-1], edges[1:])]
+            return labels + ['missing']
+        return list(self.levels_[col]) + ['other', 'missing']
+
+    def bin_codes(self, serie):
+        """ Return the bin of each value of a column """
+        col = serie.name
+        nb_bins = self.nb_bins(col)
+        if col in self.edges_:
+            values = serie.values.astype(float)
+            edges = self.edges_[col]
+            # right closed bins (a, b], the first one including the lowest value
+            codes = np.clip(np.searchsorted(edges, values, side='left') - 1, 0, nb_bins - 2)
+        else:
+            values = serie.values
+            codes = self.levels_[col].get_indexer(values)
+            codes[codes < 0] = nb_bins - 2
+        codes[pd.isnull(values)] = nb_bins - 1
+        return codes
+
+    def bin_counts(self, data):
+        """ Return a dictionnary {column : array of the number of rows per bin}
+        of a DataFrame or an iterable of DataFrames """
+        chunks = [data] if isinstance(data, pd.DataFrame) else data
+        counts = dict((col, np.zeros(self.nb_bins(col), dtype=np.int64)) for col in self.columns)
+        for chunk in chunks:
+            for col in self.columns:
+                counts[col] += np.bincount(self.bin_codes(chunk[col]), minlength=self.nb_bins(col))
+        return counts
+
+    def accumulator(self):
+        """ Return an empty PSIAccumulator using the bins of the monitor """
+        return PSIAccumulator(self)
+
+    def smoothed_pct(self, counts):
+        """ proportions per bin of an array of counts, with the pseudo counts """
+        counts = counts + float(self.smoothing)
+        return counts / counts.sum()
+
+    def psi_from_counts(self, counts):
+        """ Return a Series of the psi of each column from bin_counts """
+        return pd.Series(dict((col, psi_from_pct(self.smoothed_pct(self.bench_counts_[col]),
+                                                 self.smoothed_pct(counts[col])))
+                              for col in self.columns), index=self.columns)
+
+    def psi(self, data):
+        """ Return a Series of the psi of each column of a DataFrame or of an
+        iterable of DataFrames against the benchmark """
+        return self.psi_from_counts(self.bin_counts(data))
+
+    def report(self, data, col):
+        """ Return a DataFrame of the benchmark and target proportions per bin
+        of the column col (without smoothing) """
+        counts = self.bin_counts(data)[col]
+        bench_counts = self.bench_counts_[col]
+        return pd.DataFrame({'ben_pct': bench_counts / float(max(bench_counts.sum(), 1)),
+                             'target_pct': counts / float(max(counts.sum(), 1))},
+                            index=self.bin_labels(col), columns=['ben_pct', 'target_pct'])
+
+
+class PSIAccumulator(object):
+    """
+    Mergeable counts per bin of the rows of a stream, using the bins of a
+    fitted DriftMonitor, to get the current psi of each column at any time
+    with a memory of one count per bin and column.
+
+    The accumulators of several workers (or processes, they can be pickled)
+    can be merged if they use the same bins.
+
+    Parameters
+    ----------
+    monitor : a fitted DriftMonitor
+
+    Examples
+    --------
+    * accumulator = PSIAccumulator(monitor)
+    * accumulator.update(micro_batch)
+    * accumulator.merge(other_worker_accumulator)
+    * accumulator.psi() : current psi of each column
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.counts = monitor.bin_counts([])
+        self.nrow = 0
+
+    def update(self, chunk):
+        """ Add the rows of a DataFrame to the counts """
+        counts = self.monitor.bin_counts(chunk)
+        for col in self.counts:
+            self.counts[col] += counts[col]
+        self.nrow += len(chunk.index)
+        return self
+
+    def merge(self, other):
+        """ Merge the counts of another PSIAccumulator with the same bins """
+        if other.monitor is not self.monitor:
+            same_bins = (other.monitor.columns == self.monitor.columns and
+                         all(other.monitor.bin_labels(col) == self.monitor.bin_labels(col)
+                             for col in self.monitor.columns))
+            if not same_bins:
+                raise ValueError("The accumulators should use the same bins")
+        for col in self.counts:
+            self.counts[col] += other.counts[col]
+        self.nrow += other.nrow
+        return self
+
+    def psi(self):
+        """ Return a Series of the current psi of each column """
+        return self.monitor.psi_from_counts(self.counts)
+
+    def reset(self):
+        """ Reset the counts, to start a new monitoring window """
+        self.counts = self.monitor.bin_counts([])
+        self.nrow = 0
+        return self
@@ -6,33 +6,189 @@
 
 
 """
+import warnings
+from collections import OrderedDict
+from functools import partial
 import pandas as pd
 import numpy as np
+from sklearn.base import clone
 from sklearn.feature_selection import SelectKBest, f_classif
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+from sklearn.metrics import accuracy_score, roc_auc_score
+from decam.correlation import corr_matrix, recursive_pairwise_elimination
+from decam.utils import parallel_apply
+from decam.sampling import sample_positions
+
+
+# module level fitting functions, so they can be run in a pool of processes
+
+def fit_rf(df, resp, n_estimators, criterion, max_features, n_jobs=1, random_state=None):
+	if max_features == 'auto':
+		max_features = int(np.sqrt(len(df.columns)))
+	return RandomForestClassifier(n_estimators=n_estimators, criterion=criterion, max_features=max_features, bootstrap=True, n_jobs=n_jobs, random_state=random_state).fit(df, resp)
+
+def fit_boosting(df, resp, n_estimators, learning_rate, max_depth, random_state=None, **kwargs):
+	return GradientBoostingClassifier(n_estimators=n_estimators, learning_rate=learning_rate, max_depth=max_depth, random_state=random_state, **kwargs).fit(df, resp)
+
+def quantile_bins(df, max_bins=255):
+	""" Return a float32 array of the quantile bin of each value of the columns 
+	of df, so the splits of the trees are searched among at most max_bins 
+	values per column like histogram based boosting (the missing values get 
+	their own bin, after the last bin of the values) """
+	x = df.values.astype(float)
+	res = np.empty(x.shape, dtype=np.float32)
+	q = np.linspace(0, 1, max_bins + 1)[1:-1]
+	for j in range(x.shape[1]):
+		values = x[:, j]
+		values_notnull = values[~np.isnan(values)]
+		edges = np.unique(np.percentile(values_notnull, 100 * q)) if len(values_notnull) else np.array([])
+		res[:, j] = np.where(np.isnan(values), len(edges) + 1, np.searchsorted(edges, values))
+	return res
+
+def rank_stability(importances):
+	""" Mean of the spearman correlations between the rankings of the 
+	predictors of each pair of rows of an array of importances """
+	if len(importances) < 2:
+		return np.nan
+	cor = pd.DataFrame(np.transpose(importances)).corr(method='spearman').values
+	return cor[np.triu_indices(len(cor), 1)].mean()
+
+def _predict(model, x, scoring):
+	with warnings.catch_warnings():
+		# the models fitted on a DataFrame warn about the names of the columns
+		warnings.simplefilter('ignore', category=UserWarning)
+		if scoring == 'roc_auc':
+			return model.predict_proba(x)[:, 1]
+		return model.predict(x)
+
+def _metric(y, pred, scoring):
+	if scoring == 'roc_auc':
+		return roc_auc_score(y, pred)
+	return accuracy_score(y, pred)
+
+def permutation_scores(model, x, y, scoring='accuracy', random_state=None):
+	""" Return the decrease of the score ('accuracy' or 'roc_auc') of a fitted 
+	model on the array x, y when each column of x is shuffled (one repeat).
+
+	x is copied once in a buffer where only the shuffled column is written 
+	before the prediction and restored after it.
+	"""
+	rng = np.random.RandomState(random_state)
+	n, p = x.shape
+	baseline = _metric(y, _predict(model, x, scoring), scoring)
+	buffer = x.copy()
+	res = np.empty(p)
+	for j in range(p):
+		buffer[:, j] = x[rng.permutation(n), j]
+		res[j] = baseline - _metric(y, _predict(model, buffer, scoring), scoring)
+		buffer[:, j] = x[:, j]
+	return res
+
+def fit_kbest(df, resp, score_func, k):
+	return SelectKBest(score_func=score_func, k=k).fit(df, resp)
+
+def fit_rpe(df, cutoff, method, block_size=10000, memmap_dir=None):
+	cor = corr_matrix(df, method=method, block_size=block_size, memmap_dir=memmap_dir)
+	return recursive_pairwise_elimination(cor, cutoff=cutoff)
+
+# data shared by the models fitted in a pool, set once per process by share_data
+_shared_data = {}
+
+def share_data(data):
+	_shared_data.clear()
+	_shared_data.update(data)
+
+def fit_model(name, params, n_jobs=1, random_state=None, data=None):
+	""" Fit the model of a method of FeatureImportance ('rf', 'boosting', 
+	'kbest' or 'rpe') on data, a dict with the keys df and resp, by default 
+	the data set by share_data """
+	data = _shared_data if data is None else data
+	if name == 'rf':
+		return fit_rf(data['df'], data['resp'], *params, n_jobs=n_jobs, random_state=random_state)
+	elif name == 'boosting':
+		return fit_boosting(data['df'], data['resp'], *params, random_state=random_state)
+	elif name == 'kbest':
+		return fit_kbest(data['df'], data['resp'], *params)
+	return fit_rpe(data['df'], *params)
 
 
 class FeatureImportance:
+	""" Importance of the predictors of a dataframe for a response with 
+	several methods (random forest, boosting, univariate tests, correlations).
+
+	The fitted models are cached per method and parameters in self._models, 
+	so calling a method or summary again with the same parameters reuses them, 
+	the least recently used models are dropped beyond max_models models.
+
+	Parameters:
+	* df: the dataframe of the predictors
+	* resp: the response
+	* n_jobs: number of jobs of the random forest, -1 for the number of cpus
+	* random_state: seed of the random forest and the boosting models
+	* holdout: fraction of the rows (random rows) held out to score the 
+	permutation importance of a copy of the rf or boosting model fitted on the 
+	other rows, default 0 (the models fitted on all the rows are scored on 
+	all the rows). The other methods always use all the rows.
+	* max_models: maximum number of cached fitted models, default 16
+	"""
 	
-	def __init__(self, df, resp):
+	def __init__(self, df, resp, n_jobs=1, random_state=None, holdout=0., max_models=16):
 		self.dataframe = df
 		self.response = resp
+		self.n_jobs = n_jobs
+		self.random_state = random_state
+		self.holdout = holdout
+		self.max_models = max_models
 		self.predictors = pd.Series(self.dataframe.columns)
+		is_holdout = np.zeros(len(df.index), dtype=bool)
+		if holdout:
+			is_holdout[sample_positions(len(df.index), int(holdout * len(df.index)), random_state=random_state)] = True
+		self._resp = np.asarray(resp)
+		# the rows fitting and scoring the models of the permutation importance
+		self._train_df, self._train_resp = df.iloc[~is_holdout], self._resp[~is_holdout]
+		self._holdout_df, self._holdout_resp = df.iloc[is_holdout], self._resp[is_holdout]
+		self._models = OrderedDict()
+		self._rf_model = None
+		self._boosting_model = None
 		self._rf_imp = []
 		self._boosting_imp = []
 		self._rpe_imp = []
 		self._kbest_imp = []
-		self._rf_param = []
-		self._boosting_param = []
-		self._rpe_param = []
-		self._kbest_param = []
+
+	def _data(self):
+		return {'df': self.dataframe, 'resp': self._resp}
+
+	def _fit_task(self, name, *params, **kwargs):
+		""" Return the key of the cached model of a method and the function 
+		fitting it, with shared = True the function uses the data set by 
+		share_data, n_jobs is the number of jobs of the random forest """
+		key = (name,) + params
+		data = None if kwargs.get('shared') else self._data()
+		return key, partial(fit_model, name, params, n_jobs=kwargs.get('n_jobs', self.n_jobs), 
+			random_state=self.random_state, data=data)
+
+	def _cache(self, key, model):
+		self._models[key] = model
+		while len(self._models) > self.max_models:
+			self._models.popitem(last=False)
+
+	def _cached(self, key, func):
+		""" Return the cached model of key (marked as the most recently used), 
+		fitting it with func if needed """
+		model = self._models.pop(key) if key in self._models else func()
+		self._cache(key, model)
+		return model
+
+	def _model(self, name, *params):
+		""" Return the cached fitted model of a method, fitting it if needed """
+		return self._cached(*self._fit_task(name, *params))
 
 	def rf(self, n_estimators=500, criterion='gini', max_features='auto'):
 		""" Returns the importances calculated by a random forest classifier.
 		
-		To make the method more effective, the result is stored in a private 
-		property, so if it is used with the same parameters again, it will only
-		have to print the result.
+		To make the method more effective, the fitted model is cached, so if it 
+		is used with the same parameters again, it will only have to print the 
+		result. The forest is built with self.n_jobs jobs.
 
 		Parameters:
 		* n_estimators: number of trees in the forest
@@ -42,38 +198,64 @@ class FeatureImportance:
 		* max_features: number of features to select at each split
 		
 		 """
-		if self._rf_param == [n_estimators, criterion, max_features]:
-			return pd.DataFrame({'Predictors': self.predictors, 'RF': self._rf_imp})
-		else:
-			self._rf_param = [n_estimators, criterion, max_features]
-			if max_features == 'auto':
-				model = RandomForestClassifier(n_estimators=n_estimators, criterion=criterion, max_features=int(np.sqrt(len(self.dataframe.columns))), bootstrap=True).fit(self.dataframe, self.response)
-			else:
-				model = RandomForestClassifier(n_estimators=n_estimators, criterion=criterion, max_features=max_features, bootstrap=True).fit(self.dataframe, self.response)
-
-			self._rf_imp = model.feature_importances_/model.feature_importances_.max()
-			return pd.DataFrame({'Predictors': self.predictors, 'RF': self._rf_imp})
+		self._rf_model = self._model('rf', n_estimators, criterion, max_features)
+		self._rf_imp = self._rf_model.feature_importances_/self._rf_model.feature_importances_.max()
+		return pd.DataFrame({'Predictors': self.predictors, 'RF': self._rf_imp})
 		
-	def boosting(self, n_estimators=2000, learning_rate=.1, max_depth=1):
+	def boosting(self, n_estimators=2000, learning_rate=.1, max_depth=1, fast=False,
+		sample_size=100000, n_subsamples=5, max_bins=255, n_iter_no_change=10, 
+		validation_fraction=.1, n_jobs=1):
 		""" Returns the importance calculated by a gradient boosting classifier.
 
-		To make the method more effective, the result is stored in a private 
-		property, so if it is used with the same parameters again, it will only
-		have to print the result.
+		To make the method more effective, the fitted model is cached, so if it 
+		is used with the same parameters again, it will only have to print the 
+		result.
+
+		With fast = True, n_subsamples models are fitted by a pool of n_jobs 
+		processes, each on a random subsample of sample_size rows whose values 
+		are replaced by their quantile bin (at most max_bins split values per 
+		predictor, the bins are computed on the subsample), with stochastic boosting (subsample of .5 per stage) and 
+		early stopping when the loss on validation_fraction of the rows does 
+		not improve for n_iter_no_change stages. The importance is the mean of 
+		the importances of the models, Boosting_std their standard deviation, 
+		and self._boosting_stability the mean spearman correlation between the 
+		rankings of the predictors by the different models.
 
 		Parameters:
 		* n_estimators: number of boosting stages to perform
 		* learning_rate: coefficient by which shrink the contribution of each tree
 		* max_depth: maximum depth of the individual regression estimators
+		* fast: use the subsampled, binned and early stopped models
 
 		"""
-		if self._boosting_param == [n_estimators, learning_rate, max_depth]:
-			return pd.DataFrame({'Predictors': self.predictors, 'Boosting': self._boosting_imp})
-		else:
-			self._boosting_param = [n_estimators, learning_rate, max_depth]
-			model = GradientBoostingClassifier(n_estimators=n_estimators, learning_rate=learning_rate, max_depth=max_depth).fit(self.dataframe, self.response)
-			self._boosting_imp = model.feature_importances_/model.feature_importances_.max()
+		if not fast:
+			self._boosting_model = self._model('boosting', n_estimators, learning_rate, max_depth)
+			self._boosting_imp = self._boosting_model.feature_importances_/self._boosting_model.feature_importances_.max()
 			return pd.DataFrame({'Predictors': self.predictors, 'Boosting': self._boosting_imp})
+		key = ('boosting_fast', n_estimators, learning_rate, max_depth, sample_size, n_subsamples, 
+			max_bins, n_iter_no_change, validation_fraction)
+
+		def fit_models():
+			y = self._resp
+			tasks = {}
+			for i in range(n_subsamples):
+				seed = None if self.random_state is None else self.random_state + i
+				positions = sample_positions(len(y), sample_size, random_state=seed)
+				x = quantile_bins(self.dataframe.iloc[positions], max_bins)
+				tasks[i] = partial(fit_boosting, x, y[positions], n_estimators, 
+					learning_rate, max_depth, random_state=seed, subsample=.5, 
+					n_iter_no_change=n_iter_no_change, validation_fraction=validation_fraction)
+			results = parallel_apply(tasks, n_jobs=n_jobs, processes=True)
+			return [results[i] for i in range(n_subsamples)]
+
+		self._boosting_model = self._cached(key, fit_models)
+		importances = np.array([model.feature_importances_/model.feature_importances_.max() 
+			for model in self._boosting_model])
+		self._boosting_stability = rank_stability(importances)
+		mean = importances.mean(axis=0)
+		self._boosting_imp = mean/mean.max()
+		return pd.DataFrame({'Predictors': self.predictors, 'Boosting': self._boosting_imp, 
+			'Boosting_std': importances.std(axis=0)/mean.max()}, columns=['Predictors', 'Boosting', 'Boosting_std'])
 
 	def kbest(self, score_func=f_classif, k='all'):
 		""" Returns the scores of the k best predictors according to the ANOVA 
@@ -89,16 +271,12 @@ class FeatureImportance:
 		returns the score for all predictors
 
 		"""
-		if self._kbest_param == [score_func, k]:
-			return pd.DataFrame({'Predictors': self.predictors, 'KBest': self._kbest_imp})
-		else:
-			self._kbest_param = [score_func, k]
-			kb = SelectKBest(score_func=score_func, k=k).fit(self.dataframe, self.response)
-			self._kbest_imp = pd.Series(['Ranked below k']*len(self.predictors))
-			self._kbest_imp[ kb.get_support() ] = kb.scores_
-			return pd.DataFrame({'Predictors': self.predictors, 'KBest': self._kbest_imp})
+		kb = self._model('kbest', score_func, k)
+		self._kbest_imp = pd.Series(['Ranked below k']*len(self.predictors))
+		self._kbest_imp[ kb.get_support() ] = kb.scores_[ kb.get_support() ]
+		return pd.DataFrame({'Predictors': self.predictors, 'KBest': self._kbest_imp})
 
-	def rpe(self, cutoff=.90, method='pearson'):
+	def rpe(self, cutoff=.90, method='pearson', block_size=10000, memmap_dir=None):
 		""" Returns a series of boolean stating whether the corresponding predictor
 		remains after performing a recursive pairwise elimination.
 
@@ -112,19 +290,87 @@ class FeatureImportance:
 			'peason'
 			'kendall'
 			'spearman'
+		* block_size: number of rows per block to compute the correlation matrix
+		* memmap_dir: if not None, directory of the memory mapped ranks of 
+		spearman, see decam.correlation.corr_matrix
 
 		"""
-		if self._rpe_param == [cutoff, method]:
-			return pd.DataFrame({'Predictors': self.predictors, 'RPE': self._rpe_imp})
+		key = self._fit_task('rpe', cutoff, method)[0]
+		rpe_list = self._cached(key, partial(fit_rpe, self.dataframe, cutoff, method, block_size=block_size, memmap_dir=memmap_dir))
+		self._rpe_imp = self.predictors.apply(lambda x: (x not in rpe_list))
+		return pd.DataFrame({'Predictors': self.predictors, 'RPE': self._rpe_imp})
+
+	def permutation_importance(self, model='rf', n_repeats=5, scoring='accuracy', n_jobs=1):
+		""" Returns the permutation importance of the predictors : the decrease 
+		of the score of the fitted model of rf() or boosting() (fitted with the 
+		default parameters if needed) when a predictor is shuffled, on all the 
+		rows if holdout = 0, else on the holdout rows with a copy of the model 
+		fitted on the other rows (cached like the models of the methods).
+
+		The columns are shuffled one at a time in a reused copy of the rows 
+		(see permutation_scores) and the repeats are run by a pool of n_jobs 
+		processes.
+
+		Parameters:
+		* model: 'rf' or 'boosting'
+		* n_repeats: number of shuffles of each predictor
+		* scoring: 'accuracy' or 'roc_auc' (binary response)
+
+		"""
+		if model == 'rf':
+			if self._rf_model is None:
+				self.rf()
+			fitted = self._rf_model
+		elif model == 'boosting':
+			if self._boosting_model is None:
+				self.boosting()
+			fitted = self._boosting_model
+			if isinstance(fitted, list):
+				raise ValueError("The permutation importance needs a boosting model fitted with fast = False")
+		else:
+			raise ValueError("model should be 'rf' or 'boosting'")
+		if self.holdout:
+			key = ('permutation', model) + tuple(sorted(fitted.get_params().items()))
+			fitted = self._cached(key, lambda model=fitted: clone(model).fit(self._train_df, self._train_resp))
+			x, y = self._holdout_df.values.astype(float), self._holdout_resp
 		else:
-			self._rpe_param = [cutoff, method]
-			rpe_list = findcorr(self.dataframe, cutoff=cutoff, method=method)
-			self._rpe_imp = self.predictors.apply(lambda x: (x not in rpe_list))
-			return pd.DataFrame({'Predictors': self.predictors, 'RPE': self._rpe_imp})
-
-	def summary(self):
-		""" Returns a dataframe with the result of all the methods. """
-		return self.rf().merge(self.boosting(), on='Predictors').merge(self.kbest(), on='Predictors').merge(self.rpe(), on='Predictors')
+			x, y = self.dataframe.values.astype(float), self._resp
+		tasks = {}
+		for i in range(n_repeats):
+			seed = None if self.random_state is None else self.random_state + i
+			tasks[i] = partial(permutation_scores, fitted, x, y, scoring=scoring, random_state=seed)
+		results = parallel_apply(tasks, n_jobs=n_jobs, processes=True)
+		scores = np.array([results[i] for i in range(n_repeats)])
+		self._permutation_scores = scores
+		return pd.DataFrame({'Predictors': self.predictors, 'Permutation': scores.mean(axis=0), 
+			'Permutation_std': scores.std(axis=0)}, columns=['Predictors', 'Permutation', 'Permutation_std'])
+
+	def summary(self, n_jobs=1, fast_boosting=False):
+		""" Returns a dataframe with the result of all the methods. 
+
+		The models not fitted yet (default parameters of each method) are fitted 
+		concurrently by a pool of n_jobs processes (-1 for the number of cpus), 
+		and cached for the next calls. The data is sent once to each process 
+		(not with each model), and the random forest is then built with one job 
+		per process. With fast_boosting the boosting importance is computed with 
+		boosting(fast = True).
+		"""
+		tasks = [('rf', 500, 'gini', 'auto'), ('kbest', f_classif, 'all'), ('rpe', .90, 'pearson')]
+		if not fast_boosting:
+			tasks.append(('boosting', 2000, .1, 1))
+		inner_jobs = self.n_jobs if n_jobs == 1 else 1
+		tasks = dict(self._fit_task(*task, shared=True, n_jobs=inner_jobs) for task in tasks)
+		tasks = dict((key, func) for key, func in tasks.items() if key not in self._models)
+		try:
+			# the keys of the pool results are the method names (sortable)
+			results = parallel_apply(dict((key[0], func) for key, func in tasks.items()), n_jobs=n_jobs, 
+				processes=True, initializer=share_data, initargs=(self._data(),))
+		finally:
+			_shared_data.clear()
+		for key in tasks:
+			self._cache(key, results[key[0]])
+		boosting = self.boosting(fast=True, n_jobs=n_jobs) if fast_boosting else self.boosting()
+		return self.rf().merge(boosting, on='Predictors').merge(self.kbest(), on='Predictors').merge(self.rpe(), on='Predictors')
 
 	pass
 
@@ -15,16 +15,35 @@ The Goal of this module is to rely on a dataframe structure for modelling g
 
 import pandas as pd 
 import numpy as np 
-from numpy.random import permutation
+from decam.profiling import (profile_df, ProfileAccumulator, find_duplicated_columns,
+    find_duplicated_rows, df_fingerprint, has_few_levels, top_k_counts, top_k_df)
+from decam.cache import DiskCache, disk_cached, memoized
+from decam.sketches import count_distinct
+from decam.sampling import (sample_positions, stratified_positions, miss_rate_bound,
+    Reservoir)
+from decam.correlation import corr_matrix, recursive_pairwise_elimination
+from decam.utils import parallel_apply
+from decam.preprocessing import DummyEncoder, Imputer
 
 def cserie(serie):
     return serie[serie].index.tolist()
 
+def exact_count_distinct(serie):
+    """ serie.nunique(), the numeric columns are sorted instead of hashed 
+    (faster, nunique builds a hash table of the values) """
+    values = serie.values
+    if not isinstance(values, np.ndarray) or values.dtype.kind not in 'biuf':
+        return serie.nunique()
+    if values.dtype.kind == 'f':
+        values = values[~np.isnan(values)]
+    values = np.sort(values)
+    return int(len(values) and 1 + np.count_nonzero(values[1:] != values[:-1]))
+
 
 #########################################################
 # Import modules for the Model class 
 #########################################################
-from sklearn import cross_validation
+from sklearn.model_selection import ShuffleSplit, KFold, LeaveOneOut
 
 
 #########################################################
@@ -43,12 +62,23 @@ class DataCleaner(object):
     homogenous structure that is a numpy array.
 
     When you used a method the output will be stored in a instance attribute so you 
-    don't have to compute the result again. 
+    don't have to compute the result again. The results are memoized per method 
+    and arguments, they are dropped when self.data is replaced, call 
+    invalidate() if you modify self.data in place.
+
+    The results of the most expensive methods can also be persisted in a 
+    cache directory, keyed by a fingerprint of the data and the parameters of 
+    the call, so they are not computed again on unchanged data.
 
     Parameters
     ----------
     data : a pandas dataframe
     label : a string naming the column of the output you want predict 
+    cache_dir : a directory to persist the results, default None (no disk cache)
+    cache_size : the max size in bytes of the cache directory, the least 
+    recently used results are deleted above it, default 1GB
+    random_state : the seed of the sample of rows shared by the sample based 
+    methods (sample_df, sample_checks), default 0
 
     Examples
     --------
@@ -59,12 +89,31 @@ class DataCleaner(object):
     """
 
 
-    def __init__(self,data):
+    def __init__(self,data,cache_dir = None,cache_size = 1e9,random_state = 0):
         assert isinstance(data, pd.DataFrame)
-        self.data = data
+        self.random_state = random_state
+        self._disk_cache = DiskCache(cache_dir, cache_size) if cache_dir else None
         # if not self.label:
         #     print("""the label column is empty the data will be considered 
         #         as a dataset of predictors""")
+        self.data = data
+
+    @property
+    def data(self):
+        """ the audited DataFrame, assigning it drops the computed results """
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.invalidate()
+
+    def invalidate(self):
+        """ Drop all the results computed on the data, to call after modifying 
+        self.data in place (it is done automatically when self.data is assigned 
+        or reshaped) """
+        self._memo = {}
+        self._memo_shape = self.data.shape
         self._nrow = len(self.data.index)
         self._ncol= len(self.data.columns)
         self._dfnumi = (self.data.dtypes == float)|(self.data.dtypes == int)
@@ -82,8 +131,33 @@ class DataCleaner(object):
         self._corrcolumns = []
         self._dict_info = {}
         self._structure = pd.DataFrame()
+        self._profile = pd.DataFrame()
+        self._sample_positions = np.array([], dtype = np.int64)
         self._string_info = ""
 
+    @classmethod
+    def from_chunks(cls, chunks):
+        """ Build a StreamingDataCleaner from an iterable of pandas DataFrame
+        chunks, the chunks are audited one by one with a bounded memory """
+        return StreamingDataCleaner(chunks)
+
+    @classmethod
+    def from_csv(cls, path, chunksize = 100000, **kwargs):
+        """ Audit a csv file bigger than the RAM by reading it by chunks of
+        chunksize rows, kwargs are passed to pandas.read_csv.
+        You should specify the dtype of ambiguous columns to get the same type
+        for every chunk. """
+        return cls.from_chunks(pd.read_csv(path, chunksize = chunksize, **kwargs))
+
+    @classmethod
+    def from_parquet(cls, path, chunksize = 100000, columns = None):
+        """ Audit a parquet file bigger than the RAM by reading it by batches
+        of chunksize rows (pyarrow is required) """
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        return cls.from_chunks(batch.to_pandas() for batch in
+            parquet_file.iter_batches(batch_size = chunksize, columns = columns))
+
     # def get_label(self):
     #     """ return the Serie of label you want predict """
     #     if not self.label:
@@ -91,39 +165,176 @@ class DataCleaner(object):
     #             as a dataset of predictors""")
     #     return self.data[self.label]
 
-    def count_unique(self):
-        """ Return a serie with the number of unique value per columns """
-        if len(self._count_unique):
-            return self._count_unique
-        self._count_unique = self.data.apply(lambda x: x.nunique(), axis = 0)
+    @memoized
+    def fingerprint(self):
+        """ Return a fingerprint of the content of the data, 
+        see decam.profiling.df_fingerprint """
+        return df_fingerprint(self.data)
+
+    @memoized
+    def profile(self, n_jobs = 1):
+        """ Return the profile of each column computed in a single pass
+        (missing values, unique values, min, max, top 2 frequencies, max length
+        of strings, key) see decam.profiling.profile_df, the blocks of columns 
+        are profiled by n_jobs threads """
+        self._profile = self._profile_df(n_jobs = n_jobs)
+        return self._profile
+
+    @disk_cached
+    def _profile_df(self, n_jobs = 1):
+        return profile_df(self.data, n_jobs = n_jobs)
+
+    @memoized
+    def count_unique(self, approx = False, error = 0.01, boundaries = None):
+        """ Return a serie with the number of unique value per columns 
+
+        If approx is True, the number of unique values is estimated with a 
+        HyperLogLog sketch of relative standard error error, by chunks so the 
+        memory is bounded (see decam.sketches.count_distinct). The columns with 
+        less distinct values than the registers of the sketch and the category 
+        columns are counted exactly. The exact count is only computed for the 
+        columns whose estimation is within 3 standard errors of the number of 
+        rows (key detection) or of one of the values of the list boundaries. """
+        if approx:
+            return self._approx_count_unique(error = error, boundaries = boundaries)
+        self._count_unique = self.profile()['nb_unique_values']
         return self._count_unique
 
-
-    def sample_df(self,pct = 0.05,nr = 10,threshold = None):
-        """ sample a number of rows of a dataframe = min(max(0.05*nrow(self,nr),threshold)"""
+    @memoized
+    def top_k(self, k = 2):
+        """ Return the k most common values of each column (missing values 
+        excluded) and their frequencies as a DataFrame with the columns 
+        top1_value, top1_freq, ..., topk_value, topk_freq. 
+        For k <= 2 they are read from the profile, see decam.profiling.top_k_df """
+        if k <= 2:
+            columns = []
+            for i in range(k):
+                columns += ['top{0}_value'.format(i + 1), 'top{0}_freq'.format(i + 1)]
+            return self.profile().loc[:, columns]
+        return top_k_df(self.data, k = k)
+
+    def _approx_count_unique(self, error = 0.01, boundaries = None):
+        boundaries = [self._nrow] + list(boundaries or [])
+        res = pd.Series(0, index = self.data.columns)
+        for col in self.data.columns:
+            serie = self.data[col]
+            if str(serie.dtype) == 'category':
+                # the used codes are counted exactly without hashing
+                codes = serie.cat.codes.values
+                res[col] = np.count_nonzero(np.bincount(codes[codes >= 0], 
+                    minlength = len(serie.cat.categories)))
+                continue
+            head = serie.values[:2 ** 16]
+            if len(serie.values) > len(head) and len(pd.unique(head)) == len(head):
+                # no duplicate in the first rows : the estimation of a probable 
+                # key would be near the number of rows, count it exactly at once
+                res[col] = exact_count_distinct(serie)
+                continue
+            estimate, std_error = count_distinct(serie.values, error = error)
+            if std_error and any(abs(estimate - b) <= 3 * std_error * b + 1 for b in boundaries):
+                # too close to a decision boundary, fallback to the exact count
+                estimate = exact_count_distinct(serie)
+            res[col] = estimate
+        return res
+
+
+    def sample_positions(self, k):
+        """ Return the positions of k sampled rows. One seeded sample is drawn 
+        per data and shared by all the sample based methods : a smaller sample 
+        is a prefix of it, it is only drawn again for a bigger k """
+        k = min(int(k), self._nrow)
+        if self._memo_shape != self.data.shape:
+            self.invalidate()
+        if len(self._sample_positions) < k:
+            self._sample_positions = sample_positions(self._nrow, k, 
+                random_state = self.random_state)
+        return self._sample_positions[:k]
+
+    def _sample_size(self, pct = 0.05, nr = 10, threshold = None):
         a = max(int(pct*float(len(self.data.index))),nr)
         if threshold:
             a = min(a,threshold)
-        return self.data.loc[permutation(self.data.index)[:a]]
+        return a
+
+    def sample_df(self,pct = 0.05,nr = 10,threshold = None,stratify = None):
+        """ sample a number of rows of a dataframe = min(max(0.05*nrow(self,nr),threshold)
+        The rows come from the shared seeded sample (sample_positions), or from 
+        a sample stratified on the column stratify (proportional allocation, 
+        every level gets at least one row) """
+        a = self._sample_size(pct = pct, nr = nr, threshold = threshold)
+        if stratify is not None:
+            return self.data.iloc[stratified_positions(self.data[stratify], a, 
+                random_state = self.random_state)]
+        return self.data.iloc[self.sample_positions(a)]
+
+    @memoized
+    def sample_checks(self, k = 1000, confidence = 0.95, dropna = False):
+        """ Detect the candidate keys and constant columns on a sample of k rows 
+        and scan the full column only for the candidates. detectkey and 
+        constantcol use it when the profile is not computed yet.
+
+        A duplicated value (resp. two distinct values) in the sample proves the 
+        column is not a key (resp. not constant), so these verdicts need no 
+        full scan. For a column constant in the sample, the rate of rows with 
+        another value is below max_other_rate at the given confidence level.
+        Missing values count as one distinct value, except for the keys if 
+        dropna is True (the non missing values are all distinct).
 
+        Returns
+        -------
+        a DataFrame per column with the sample verdicts (sample_key, 
+        sample_constant, max_other_rate), the final verdicts (is_key, 
+        is_constant) and full_scan, True if the column has been scanned
+        """
+        sample = self.data.iloc[self.sample_positions(k)]
+        k = len(sample.index)
+        nb_unique_sample = sample.nunique(dropna = False)
+        if dropna:
+            sample_key = sample.nunique() == sample.count()
+        else:
+            sample_key = nb_unique_sample == k
+        res = pd.DataFrame({'sample_key': sample_key,
+            'sample_constant': nb_unique_sample <= 1}, 
+            columns = ['sample_key', 'sample_constant'])
+        res['max_other_rate'] = np.where(res.sample_constant, 
+            miss_rate_bound(k, confidence), np.nan)
+        res['full_scan'] = (res.sample_key | res.sample_constant) & (k < self._nrow)
+        res['is_key'] = res.sample_key
+        res['is_constant'] = res.sample_constant
+        for col in cserie(res.full_scan):
+            nb_unique = self.data[col].nunique(dropna = False)
+            if dropna:
+                res.at[col, 'is_key'] = self.data[col].nunique() == self.data[col].count()
+            else:
+                res.at[col, 'is_key'] = nb_unique == self._nrow
+            res.at[col, 'is_constant'] = nb_unique <= 1
+        return res
+
+    @memoized
     def nacolcount(self):
         """ count the number of missing values per columns """
-        if len(self._nacolcount):
-            return self._nacolcount
-        self._nacolcount =  self.data.isnull().sum(axis = 0)
-        self._nacolcount  =  pd.DataFrame(self._nacolcount ,columns = ['Nanumber'])
+        if len(self._profile):
+            nb_missing = self._profile['nb_missing']
+        else:
+            nb_missing = self.data.isnull().sum(axis = 0)
+        self._nacolcount  =  pd.DataFrame({'Nanumber': nb_missing})
         self._nacolcount['Napercentage'] = self._nacolcount['Nanumber']/(self._nrow)
         return self._nacolcount
 
+    @memoized
     def narowcount(self):
         """ count the number of missing values per columns """
-        if len(self._narowcount):
-            return self._narowcount
         self._narowcount =  self.data.isnull().sum(axis = 1)
         self._narowcount  =  pd.DataFrame(self._narowcount ,columns = ['Nanumber'])
         self._narowcount['Napercentage'] = self._narowcount['Nanumber']/(self._nrow)
         return self._narowcount
 
+    def narowcount_summary(self):
+        """ Return the number of rows per number of missing values in the row """
+        res = self.narowcount().Nanumber.value_counts().sort_index()
+        res.name = 'nb_rows'
+        return res
+
     def manymissing(self,a = 0.9,row = False):
         """ identify columns of a dataframe with many missing values ( >= a), if
         row = True row either.
@@ -139,50 +350,56 @@ class DataCleaner(object):
 
     def df_len_string(self):
         """ Return a Series with the max of the length of the string of string-type columns """
-        return self.data.drop(self._dfnum,axis = 1).apply(lambda x : np.max(x.str.len()), axis = 0 )
+        return self.profile().loc[~self._dfnumi, 'max_len_string']
 
+    @memoized
     def detectkey(self, index_format = False, pct = 0.15,dropna = False,**kwargs):
         """ identify id or key columns as an index if index_format = True or 
-        as a list if index_format = False """
-        if not dropna:
-            col_to_keep = self.sample_df(pct = pct,**kwargs).apply(lambda x: len(x.unique()) == len(x) ,axis = 0)
-            if len(col_to_keep) == 0:
-                return []
-            is_key_index = col_to_keep
-            is_key_index[is_key_index] == self.data.loc[:,is_key_index].apply(lambda x: len(x.unique()) == len(x) ,axis = 0)
-            if index_format:
-                return is_key_index
-            else :
-                return cserie(is_key_index)
+        as a list if index_format = False.
+        The keys are read from the profile if it is already computed, else the 
+        columns are checked on the shared sample of sample_df(pct, **kwargs) 
+        and only the candidates are scanned, see sample_checks """
+        if not len(self._profile):
+            is_key_index = self.sample_checks(k = self._sample_size(pct = pct, **kwargs), 
+                dropna = dropna).is_key
+        elif not dropna:
+            profile = self._profile
+            # missing values count as one distinct value
+            is_key_index = (profile.nb_unique_values + (profile.nb_missing > 0)) == self._nrow
+        else :
+            profile = self._profile
+            is_key_index = profile.nb_unique_values == (self._nrow - profile.nb_missing)
+        if index_format:
+            return is_key_index
         else :
-            col_to_keep = self.sample_df(pct = pct,**kwargs).apply(lambda x: x.nunique() == len(x.dropna()) ,axis = 0)
-            if len(col_to_keep) == 0:
-                return []
-            is_key_index = col_to_keep
-            is_key_index[is_key_index] == self.data.loc[:,is_key_index].apply(lambda x: x.nunique() == len(x.dropna()),axis = 0)
-            if index_format:
-                return is_key_index
-            else :
-                return cserie(is_key_index)
+            return cserie(is_key_index)
 
+    @memoized
     def constantcol(self,**kwargs):
-        """ identify constant columns """
-        # sample to reduce computation time 
-        if len(self._constantcol):
+        """ identify constant columns, read from the profile if it is already 
+        computed, else checked on the shared sample of sample_df(**kwargs) 
+        and scanned only for the candidates, see sample_checks """
+        if not len(self._profile):
+            self._constantcol = cserie(self.sample_checks(k = self._sample_size(**kwargs)).is_constant)
             return self._constantcol
-        col_to_keep = self.sample_df(**kwargs).apply(lambda x: len(x.unique()) == 1,axis = 0)
-        if len(cserie(col_to_keep)) == 0:
-            return []
-        self._constantcol = list(cserie(self.data.loc[:,col_to_keep].apply(lambda x: len(x.unique()) == 1,axis = 0 )))
+        profile = self._profile
+        # missing values count as one distinct value
+        self._constantcol = cserie((profile.nb_unique_values + (profile.nb_missing > 0)) == 1)
         return self._constantcol
 
-    def factors(self,nb_max_levels = 10,threshold_value = None, index = False):
+    @memoized
+    def factors(self,nb_max_levels = 10,threshold_value = None, index = False,
+        approx = False, error = 0.01):
         """ return a list of the detected factor variable, detection is based on 
         ther percentage of unicity perc_unique = 0.05 by default.
         We follow here the definition of R factors variable considering that a 
         factor variable is a character variable that take value in a list a levels
+        : a non numeric variable with less than max_levels distinct values 
+        (missing values count as a level).
 
-        this is a bad implementation 
+        The levels are counted with the profile if it is already computed, else 
+        with pandas.unique on chunks of growing size stopping as soon as the 
+        max_levels budget is reached (see decam.profiling.has_few_levels).
 
 
         Arguments 
@@ -190,44 +407,55 @@ class DataCleaner(object):
         nb_max_levels: the mac nb of levels you fix for a categorical variable
         threshold_value : the nb of of unique value in percentage of the dataframe length
         index : if you want the result as an index or a list
+        approx : estimate the number of levels with a HyperLogLog sketch, see 
+        count_unique
+        error : relative standard error of the sketch if approx is True
 
          """
         if threshold_value:
             max_levels = max(nb_max_levels,threshold_value * self._nrow)
         else:
             max_levels = nb_max_levels
-        def helper_factor(x,num_var = self._dfnum):
-            unique_value = set()
-            if x.name in num_var:
-                return False
-            else:
-                for e in x.values:
-                    if len(unique_value) >= max_levels :
-                        return False
-                    else:
-                        unique_value.add(e)
-                return True
-        
-
+        if approx:
+            nb_levels = self.count_unique(approx = True, error = error, boundaries = [max_levels])
+        elif len(self._profile):
+            nb_levels = self._profile.nb_unique_values
+        else:
+            nb_levels = None
+        if nb_levels is not None:
+            # missing values count as a level
+            nb_levels = nb_levels + (self.nacolcount().Nanumber > 0)
+            is_factor = (~self._dfnumi) & (nb_levels < max_levels)
+        else:
+            is_factor = pd.Series(False, index = self.data.columns)
+            for col in self._dfnumi.index[~self._dfnumi]:
+                is_factor[col] = has_few_levels(self.data[col], max_levels)
         if index:
-            return self.data.apply(lambda x:  helper_factor(x))
+            return is_factor
         else :
-            return cserie(self.data.apply(lambda x:  helper_factor(x)))
+            return cserie(is_factor)
 
 
-    def structure(self,threshold_factor = 10):
+    @memoized
+    @disk_cached
+    def structure(self,threshold_factor = 10, approx = False, error = 0.01):
         """ this function return a summary of the structure of the pandas DataFrame 
         data looking at the type of variables, the number of missing values, the 
-        number of unique values """
+        number of unique values 
+
+        If approx is True the number of unique values is estimated with a 
+        HyperLogLog sketch of relative standard error error, see count_unique """
 
-        if len(self._structure):
-            return self._structure
         dtypes = self.data.dtypes
         nacolcount = self.nacolcount()
         nb_missing = nacolcount.Nanumber
         perc_missing = nacolcount.Napercentage
-        nb_unique_values = self.count_unique()
-        dtypes_r = self.data.apply(lambda x: "character")
+        if approx:
+            nb_unique_values = self.count_unique(approx = True, error = error,
+                boundaries = [threshold_factor, 1])
+        else:
+            nb_unique_values = self.count_unique()
+        dtypes_r = pd.Series("character", index = self.data.columns)
         dtypes_r[self._dfnumi] = "numeric"
         dtypes_r[(dtypes_r == 'character') & (nb_unique_values <= threshold_factor)] = 'factor'
         constant_columns = (nb_unique_values == 1)
@@ -244,44 +472,54 @@ class DataCleaner(object):
         return self._structure
 
 
+    @memoized
+    @disk_cached
     def findupcol(self,threshold = 100,**kwargs):
-        """ find duplicated columns and return the result as a list of list """
-        df_s = self.sample_df(threshold = 100,**kwargs).T
-        dup_index_s = (df_s.duplicated()) | (df_s.duplicated(take_last = True))
-        
-        if len(cserie(dup_index_s)) == 0:
-            return []
-
-        df_t = (self.data.loc[:,dup_index_s]).T
-        dup_index = df_t.duplicated()
-        dup_index_complet = cserie((dup_index) | (df_t.duplicated(take_last = True)))
-
-        l = []
-        for col in cserie(dup_index):
-            index_temp = self.data[dup_index_complet].apply(lambda x: (x == self.data[col])).sum() == self._nrow
-            temp = list(self.data[dup_index_complet].columns[index_temp])
-            l.append(temp)
-        self._dupcol = l 
+        """ find duplicated columns and return the result as a list of list, 
+        one list per group of identical columns.
+        The columns duplicated on the shared sample of 
+        sample_df(threshold = threshold, **kwargs) are the candidates, only
+        these are compared with a content hash computed by chunks, see
+        decam.profiling.find_duplicated_columns """
+        sample = self.data.iloc[self.sample_positions(self._sample_size(threshold = threshold, **kwargs))]
+        candidates = set(col for group in find_duplicated_columns(sample) for col in group)
+        self._dupcol = find_duplicated_columns(self.data.loc[:, [col for col in self.data.columns 
+            if col in candidates]])
         return self._dupcol
 
 
-    def finduprow(self,subset = []):
-        """ find duplicated rows and return the result a sorted dataframe of all the
-        duplicates
+    @memoized
+    def nb_duplicated_rows(self):
+        """ number of rows identical to a previous row """
+        dups = self.duplicated_rows()
+        return len(dups.index) - dups.group.nunique()
+
+    @memoized
+    def duplicated_rows(self, subset = [], partition_dir = None, nb_partitions = 16):
+        """ Return the groups of duplicated rows (on the columns of subset if 
+        not empty) as a DataFrame indexed like the data with the columns 
+        position, group and count, see decam.profiling.find_duplicated_rows.
+        The rows are hashed once, the hashes are spilled to nb_partitions 
+        files of partition_dir if partition_dir is not None """
+        return find_duplicated_rows(self.data, subset = subset, 
+            partition_dir = partition_dir, nb_partitions = nb_partitions)
+
+    def finduprow(self, subset = [], partition_dir = None, nb_partitions = 16):
+        """ find duplicated rows and return the result a dataframe of all the
+        duplicates sorted by group of identical rows, with the id of the group 
+        (dup_group) and the size of the group (dup_count)
         subset is a list of columns to look for duplicates from this specific subset . 
         """
-        if sum(self.data.duplicated()) == 0:
+        dups = self.duplicated_rows(subset = subset, partition_dir = partition_dir,
+            nb_partitions = nb_partitions)
+        if not len(dups.index):
             print("there is no duplicated rows")
-        else: 
-            if subset:
-                dup_index = (self.data.duplicated(subset = subset)) | (self.data.duplicated(subset = subset,take_last =True)) 
-            else :    
-                dup_index = (self.data.duplicated()) | (self.data.duplicated(take_last = True))
-                
-            if subset :
-                return self.data[dup_index].sort(subset)
-            else :
-                return self.data[dup_index].sort(self.data.columns[0])
+            return None
+        dups = dups.sort_values('group', kind = 'mergesort')
+        res = self.data.iloc[dups.position.values].copy()
+        res['dup_group'] = dups.group.values
+        res['dup_count'] = dups['count'].values
+        return res
 
 
     def nearzerovar(self, freq_cut = 95/5, unique_cut = 10, save_metrics = False):
@@ -293,31 +531,34 @@ class DataCleaner(object):
                 save_metrics: if False, print dataframe and return NON near-zero var 
                 col indexes, if True, returns the whole dataframe.
         """
+        self._nearzerovar = self._nearzerovar_metrics(freq_cut = freq_cut, unique_cut = unique_cut)
+        if save_metrics:
+            return self._nearzerovar
+        else:
+            print(self._nearzerovar)
+            nzv = self._nearzerovar.nzv
+            return nzv[nzv == True].index 
+
+    @memoized
+    @disk_cached
+    def _nearzerovar_metrics(self, freq_cut, unique_cut):
         nb_unique_values = self.count_unique()
         percent_unique = 100 * nb_unique_values/self._nrow
+        top = self.top_k(k = 2)
 
-        def helper_freq(x):
-            if nb_unique_values[x.name] == 0:
-                return 0.0
-            elif nb_unique_values[x.name] == 1:
-                return 1.0
-            else:
-                return float(x.value_counts().iloc[0])/x.value_counts().iloc[1] 
-
-        freq_ratio = self.data.apply(helper_freq)
+        # ratio of the frequencies of the two most common values
+        freq_ratio = top.top1_freq.astype(float) / top.top2_freq.where(nb_unique_values > 1)
+        freq_ratio[nb_unique_values == 1] = 1.0
+        freq_ratio[nb_unique_values == 0] = 0.0
 
         zerovar = (nb_unique_values == 0) | (nb_unique_values == 1) 
         nzv = ((freq_ratio >= freq_cut) & (percent_unique <= unique_cut)) | (zerovar)
-
-        if save_metrics:
-            return pd.DataFrame({'percent_unique': percent_unique, 'freq_ratio': freq_ratio, 'zero_var': zerovar, 'nzv': nzv}, index=self.data.columns)
-        else:
-            print(pd.DataFrame({'percent_unique': percent_unique, 'freq_ratio': freq_ratio, 'zero_var': zerovar, 'nzv': nzv}, index=self.data.columns))
-            return nzv[nzv == True].index 
+        return pd.DataFrame({'percent_unique': percent_unique, 'freq_ratio': freq_ratio, 'zero_var': zerovar, 'nzv': nzv}, index=self.data.columns)
 
 
 
-    def findcorr(self, cutoff=.90, method='pearson', data_frame=False, print_mode = False):
+    def findcorr(self, cutoff=.90, method='pearson', data_frame=False, print_mode = False,
+        absolute = False, block_size = 10000, memmap_dir = None):
         """
         implementation of the Recursive Pairwise Elimination.        
         The function finds the highest correlated pair and removes the most 
@@ -326,82 +567,83 @@ class DataCleaner(object):
         
         will return a dataframe is 'data_frame' is set to True, and the list
         of predictors to remove oth        
-        Adaptation of 'findCorrelation' function in the caret package in R. 
+        Adaptation of 'findCorrelation' function in the caret package in R,
+        set absolute to True to use the absolute correlations as caret does.
+        see decam.correlation.recursive_pairwise_elimination 
+
+        The correlation matrix of the numeric (and boolean) columns is computed 
+        by blocks of block_size rows, the ranks of spearman can be stored in a 
+        memory mapped file of memmap_dir, see decam.correlation.corr_matrix.
+        The correlation matrix is cached (memory and disk cache), the 
+        elimination is run again on each call so print_mode always prints.
         """
-        res = []
-        df = self.data.copy(0)
-        cor = df.corr(method=method)
-        for col in cor.columns:
-            cor[col][col] = 0
-        
-        max_cor = cor.max()
-        if print_mode:
-            print(max_cor.max())
-        while max_cor.max() > cutoff:            
-            A = max_cor.idxmax()
-            B = cor[A].idxmax()
-            
-            if cor[A].mean() > cor[B].mean():
-                cor.drop(A, 1, inplace = True)
-                cor.drop(A, 0, inplace = True)
-                res += [A]
-            else:
-                cor.drop(B, 1, inplace = True)
-                cor.drop(B, 0, inplace = True)
-                res += [B]
-            
-            max_cor = cor.max()
-            if print_mode:
-                print(max_cor.max())
-            
+        cor = self._corr_matrix(method = method, block_size = block_size, memmap_dir = memmap_dir)
+        res = recursive_pairwise_elimination(cor, cutoff = cutoff, absolute = absolute,
+            print_mode = print_mode)
+        self._corrcolumns = res
         if data_frame:
-            return df.drop(res, 1)
+            return self.data.drop(res, axis = 1)
         else:
             return res
-            self._corrcolumns = res
+
+    @memoized
+    @disk_cached
+    def _corr_matrix(self, method, block_size, memmap_dir):
+        # the columns used by DataFrame.corr
+        columns = [col for col, dtype in self.data.dtypes.items() 
+            if pd.api.types.is_numeric_dtype(dtype)]
+        return corr_matrix(self.data, method = method, block_size = block_size, 
+            memmap_dir = memmap_dir, columns = columns)
 
     def psummary(self,manymissing_ph = 0.70,manymissing_pl = 0.05,nzv_freq_cut = 95/5, nzv_unique_cut = 10,
-    threshold = 100,string_threshold = 40, dynamic = False):
+    threshold = 100,string_threshold = 40, dynamic = False, n_jobs = 1):
         """ 
         This function will print you a summary of the dataset, based on function 
         designed is this package 
         - Output : python print 
         It will store the string output and the dictionnary of results in private variables 
 
+        The independent checks (duplicated rows and columns, keys, constant, 
+        nearzerovar, correlated and big strings columns) are run concurrently 
+        by a pool of n_jobs threads (-1 for the number of cpus), the profile 
+        of the columns is split by blocks of columns across the workers. 
+        The report is the same as with n_jobs = 1.
         """
+        # shared results computed first so the checks only read them
+        self.profile(n_jobs = n_jobs)
         nacolcount_p = self.nacolcount().Napercentage
+        self.count_unique()
+        checks = {'nb_duplicated_rows': lambda: self.nb_duplicated_rows(),
+                  'keys_detected': lambda: self.detectkey(),
+                  'dup_columns': lambda: self.findupcol(threshold = 100),
+                  'constant_columns': lambda: self.constantcol(),
+                  'nearzerovar_columns' : lambda: cserie(self.nearzerovar(nzv_freq_cut,nzv_unique_cut,save_metrics =True).nzv),
+                  'high_correlated_col' : lambda: self.findcorr(data_frame = False),
+                  'big_strings_col': lambda: cserie(self.df_len_string() > string_threshold)}
+        self._dict_info = parallel_apply(checks, n_jobs = n_jobs)
+        self._dict_info.update({'many_missing_percentage': manymissing_ph,
+                    'manymissing_columns': cserie((nacolcount_p > manymissing_ph)),
+                    'low_missing_percentage': manymissing_pl,
+                    'lowmissing_columns': cserie((nacolcount_p > 0 ) & (nacolcount_p <= manymissing_pl))})
         if dynamic:
-            print('there are {0} duplicated rows\n'.format(self.data.duplicated().sum()))
+            print('there are {0} duplicated rows\n'.format(self._dict_info['nb_duplicated_rows']))
             print('the columns with more than {0:.2%} manymissing values:\n{1} \n'.format(manymissing_ph,
-            cserie((nacolcount_p > manymissing_ph))))
+            self._dict_info['manymissing_columns']))
 
             print('the columns with less than {0:.2%} manymissing values are :\n{1} \n you should fill them with median or most common value \n'.format(
-            manymissing_pl,cserie((nacolcount_p > 0 ) & (nacolcount_p <= manymissing_pl))))
+            manymissing_pl,self._dict_info['lowmissing_columns']))
 
-            print('the detected keys of the dataset are:\n{0} \n'.format(self.detectkey()))
-            print('the duplicated columns of the dataset are:\n{0}\n'.format(self.findupcol(threshold = 100)))
-            print('the constant columns of the dataset are:\n{0}\n'.format(self.constantcol()))
+            print('the detected keys of the dataset are:\n{0} \n'.format(self._dict_info['keys_detected']))
+            print('the duplicated columns of the dataset are:\n{0}\n'.format(self._dict_info['dup_columns']))
+            print('the constant columns of the dataset are:\n{0}\n'.format(self._dict_info['constant_columns']))
 
             print('the columns with nearzerovariance are:\n{0}\n'.format(
-            list(cserie(self.nearzerovar(nzv_freq_cut,nzv_unique_cut,save_metrics =True).nzv))))
+            list(self._dict_info['nearzerovar_columns'])))
             print('the columns highly correlated to others to remove are:\n{0}\n'.format(
-            self.findcorr(data_frame = False)))
+            self._dict_info['high_correlated_col']))
             print('these columns contains big strings :\n{0}\n'.format(
-                cserie(self.df_len_string() > string_threshold)))
+                self._dict_info['big_strings_col']))
         else:
-            self._dict_info = {'nb_duplicated_rows': sum(self.data.duplicated()),
-                        'many_missing_percentage': manymissing_ph,
-                        'manymissing_columns': cserie((nacolcount_p > manymissing_ph)),
-                        'low_missing_percentage': manymissing_pl,
-                        'lowmissing_columns': cserie((nacolcount_p > 0 ) & (nacolcount_p <= manymissing_pl)),
-                        'keys_detected': self.detectkey(),
-                        'dup_columns': self.findupcol(threshold = 100),
-                        'constant_columns': self.constantcol(),
-                        'nearzerovar_columns' : cserie(self.nearzerovar(nzv_freq_cut,nzv_unique_cut,save_metrics =True).nzv),
-                        'high_correlated_col' : self.findcorr(data_frame = False),
-                        'big_strings_col': cserie(self.df_len_string() > string_threshold)
-                        } 
-
             self._string_info = u"""
 there are {nb_duplicated_rows} duplicated rows\n
 the columns with more than {many_missing_percentage:.2%} manymissing values:\n{manymissing_columns} \n
@@ -437,21 +679,40 @@ these columns contains big strings :\n{big_strings_col}\n
         return self.data.drop(pd.unique(col_to_remove),axis = 1)
 
     @staticmethod
-    def fillna_serie(serie,special_value = None ):
+    def fillna_serie(serie,special_value = None, mode = None):
         """ fill values in a serie default with the mean for numeric or the most common 
-        factor for categorical variable """
+        factor for categorical variable, mode is the most common value if it is 
+        already known (see top_k) """
         
         if special_value:
             return serie.fillna(serie.mean())
         if (serie.dtype ==  float) | (serie.dtype == int) :
             return serie.fillna(serie.mean())
         else:
-            return serie.fillna(serie.value_counts().index[0])
+            if mode is None:
+                mode = top_k_counts(serie.value_counts(), k = 1)['top1_value']
+            return serie.fillna(mode)
+
+    def imputer(self, columns = None):
+        """ Return an Imputer fitted on the columns of the data, default all the 
+        columns (mean for numeric columns, most common value for the others), 
+        to fill new batches the same way. Only the numeric columns are scanned, 
+        the most common values are read from top_k (the profile) and passed to 
+        the Imputer like the mode of fillna_serie """
+        if columns is None:
+            columns = list(self.data.columns)
+        top1 = self.top_k(k = 1).top1_value
+        modes = dict((col, top1[col]) for col in columns 
+            if not ((self.data[col].dtype == float) | (self.data[col].dtype == int)) and pd.notnull(top1[col]))
+        return Imputer(columns = columns).fit(self.data, modes = modes)
 
     def fill_low_na(self,columns_to_process = [],threshold = None):
         """ this function will return a dataframe with na value replaced int 
         the columns selected by the mean or the most common value
 
+        The fill values are stored in the Imputer self._imputer, use 
+        self._imputer.transform(new_df) to fill new batches with the same values.
+
         Arguments
         ---------
         - columns_to_process : list of columns name with na values you wish to fill 
@@ -465,15 +726,22 @@ these columns contains big strings :\n{big_strings_col}\n
         df = self.data
         if threshold:
             columns_to_process = columns_to_process + cserie(self.nacolcount().Napercentage < threshold)
-        df.loc[:,columns_to_process] = df.loc[:,columns_to_process].apply(lambda x: self.fillna_serie(x))
+        self._imputer = self.imputer(columns_to_process)
+        self._imputer.transform(df, inplace = True)
+        # the data has changed
+        self.invalidate()
         return df 
 
     def to_dummy(self,auto = False,auto_drop = False,include_na_dummy = True,
-        subset = None,levels_limit = 30,verbose = True):
+        subset = None,levels_limit = 30,verbose = True,sparse = False):
         """ 
         this function will transform categorical variables to numeric dummy 
         variables so render a homogenous pandas DataFrame (only numeric variables)
 
+        The levels are learned by a DummyEncoder stored in self._dummy_encoder, 
+        use self._dummy_encoder.transform(new_df) to encode new batches (scoring) 
+        with exactly the same dummy columns.
+
         Arguments
         ---------
         - auto : False if you want to disable the automatic transformation of the 
@@ -494,21 +762,26 @@ these columns contains big strings :\n{big_strings_col}\n
         - verbose : print if there is still non numeric variables in yout output,
         default True.
 
+        - sparse : True to get the dummies as pandas sparse columns, for high 
+        cardinality factors, default False.
+
         Returns 
         --------
         a homogenous pandas DataFrame with only numeric variables
         """
-        df = self.data.copy()
+        col_to_transform = []
         if auto:
-            col_to_transform = self.factors(nb_max_levels = levels_limit)
-            df = pd.get_dummies(df,columns = col_to_transform,dummy_na = True)
+            col_to_transform += self.factors(nb_max_levels = levels_limit)
         if subset : 
-            df = pd.get_dummies(df,columns = subset,dummy_na = True)
+            col_to_transform += [col for col in subset if col not in col_to_transform]
+        self._dummy_encoder = DummyEncoder(columns = col_to_transform, dummy_na = include_na_dummy)
+        df = self._dummy_encoder.fit_transform(self.data, sparse = sparse)
+        is_numeric = df.dtypes.apply(lambda dtype: dtype.kind in 'biuf')
         if auto_drop: 
-            df = df[(df.dtypes == float)|(df.dtypes == int)]
+            df = df.loc[:, is_numeric]
         if verbose : 
-            if cserie(~((df.dtypes == float)|(df.dtypes == int))):
-                print("There are still non numeric variables {0}".format(cserie(~((df.dtypes == float)|(df.dtypes == int)))))
+            if cserie(~is_numeric):
+                print("There are still non numeric variables {0}".format(cserie(~is_numeric)))
         return df 
 
     def pandas_to_ndarray(self):
@@ -528,6 +801,185 @@ these columns contains big strings :\n{big_strings_col}\n
 
 
 
+class _AccumulatorCleaner(DataCleaner):
+    """ DataCleaner of the empty frame of a ProfileAccumulator, its profile 
+    (and every result derived from it) is the profile of the accumulated chunks """
+
+    def __init__(self, accumulator, random_state = 0):
+        self._accumulator = accumulator
+        DataCleaner.__init__(self, accumulator.empty_frame(), random_state = random_state)
+
+    def invalidate(self):
+        DataCleaner.invalidate(self)
+        self._nrow = self._accumulator.nrow
+        # the profile is already known, the other results are derived from it
+        self.profile()
+
+    def _profile_df(self, n_jobs = 1):
+        return self._accumulator.to_profile()
+
+
+class StreamingDataCleaner(object):
+    """
+    DataCleaner working on data read by chunks, so you can audit files that do
+    not fit in memory. The chunks are reduced to a mergeable ProfileAccumulator
+    so nacolcount, narowcount_summary, count_unique, top_k, constantcol, 
+    manymissing, detectkey, factors, structure, nearzerovar, df_len_string and 
+    psummary give the same output as the in-memory DataCleaner, except for the 
+    columns with more than max_values distinct values.
+
+    The value counts of a column are exact up to max_values distinct values, 
+    then they are sketched (see ProfileAccumulator, is_sketched) so the memory 
+    is bounded for key like columns : the number of unique values of these 
+    columns is a HyperLogLog estimate and the frequencies of their most common 
+    values are lower bounds (Misra-Gries), see count_unique and top_k. The checks needing all the rows at once (duplicated 
+    rows and columns, correlations, cleaning and transformation of the data) 
+    are only available on a DataCleaner. sample_df draws its rows from a 
+    reservoir sample of sample_size rows of the stream.
+
+    Examples
+    --------
+    * cleaner = DataCleaner.from_csv('big_file.csv', chunksize = 100000)
+    * cleaner.structure() : global structure of your file
+    * cleaner.psummary()
+    """
+
+    def __init__(self, chunks, sample_size = 10000, random_state = 0, max_values = 10000):
+        self._accumulator = ProfileAccumulator(max_values = max_values)
+        self._reservoir = Reservoir(sample_size, random_state = random_state)
+        self.random_state = random_state
+        for chunk in chunks:
+            self._accumulator.update(chunk)
+            self._reservoir.update(chunk)
+        self._load_accumulator()
+
+    def _load_accumulator(self):
+        self._cleaner = _AccumulatorCleaner(self._accumulator, random_state = self.random_state)
+        self._nrow = self._cleaner._nrow
+        self._ncol = self._cleaner._ncol
+        self._dfnum = self._cleaner._dfnum
+        self._dfchar = self._cleaner._dfchar
+        self._dict_info = {}
+        self._string_info = ""
+
+    def update(self, chunk):
+        """ Add a new chunk to the audited data and reset the results """
+        self._accumulator.update(chunk)
+        self._reservoir.update(chunk)
+        self._load_accumulator()
+        return self
+
+    def profile(self):
+        """ Return the profile of each column, see DataCleaner.profile """
+        return self._cleaner.profile()
+
+    def nacolcount(self):
+        """ count the number of missing values per columns """
+        return self._cleaner.nacolcount()
+
+    def narowcount_summary(self):
+        """ Return the number of rows per number of missing values in the row """
+        return self._accumulator.narowcount_summary()
+
+    def is_sketched(self, col):
+        """ True if the value counts of the column are approximated (more than 
+        max_values distinct values) """
+        return self._accumulator.is_sketched(col)
+
+    def count_unique(self):
+        """ Return a serie with the number of unique value per columns. 
+        For the sketched columns (is_sketched) it is an estimate (HyperLogLog) 
+        with a relative standard error of about 1%, clamped to the number of 
+        non missing values """
+        return self._cleaner.count_unique()
+
+    def top_k(self, k = 2):
+        """ Return the k <= 2 most common values of each column and their 
+        frequencies, see DataCleaner.top_k. For the sketched columns 
+        (is_sketched) the frequencies are lower bounds of the counts, 
+        underestimated by at most nb rows / (max_values + 1), and a value 
+        less frequent than that bound can be missed (Misra-Gries, see 
+        decam.sketches.FrequentItems) """
+        if k > 2:
+            raise ValueError("only the 2 most common values are kept in streaming mode")
+        return self._cleaner.top_k(k = k)
+
+    def manymissing(self, a = 0.9):
+        """ identify columns of a dataframe with many missing values ( >= a)
+        - the output is a list """
+        return self._cleaner.manymissing(a = a)
+
+    def df_len_string(self):
+        """ Return a Series with the max of the length of the string of string-type columns """
+        return self._cleaner.df_len_string()
+
+    def detectkey(self, index_format = False, dropna = False):
+        """ identify id or key columns, see DataCleaner.detectkey """
+        return self._cleaner.detectkey(index_format = index_format, dropna = dropna)
+
+    def constantcol(self):
+        """ identify constant columns """
+        return self._cleaner.constantcol()
+
+    def factors(self, nb_max_levels = 10, threshold_value = None, index = False):
+        """ return the detected factor variables, see DataCleaner.factors """
+        return self._cleaner.factors(nb_max_levels = nb_max_levels, 
+            threshold_value = threshold_value, index = index)
+
+    def structure(self, threshold_factor = 10):
+        """ return a summary of the structure of the data, see DataCleaner.structure """
+        return self._cleaner.structure(threshold_factor = threshold_factor)
+
+    def nearzerovar(self, freq_cut = 95/5, unique_cut = 10, save_metrics = False):
+        """ identify predictors with near-zero variance, see DataCleaner.nearzerovar """
+        return self._cleaner.nearzerovar(freq_cut = freq_cut, unique_cut = unique_cut,
+            save_metrics = save_metrics)
+
+    def sample_df(self, pct = 0.05, nr = 10, threshold = None):
+        """ sample a number of rows of the stream = min(max(0.05*nrow(self,nr),threshold)
+        from the reservoir sample """
+        a = max(int(pct*float(self._nrow)),nr)
+        if threshold:
+            a = min(a,threshold)
+        if a > self._reservoir.k:
+            raise ValueError("the reservoir only keeps {0} rows, use a bigger "
+                "sample_size".format(self._reservoir.k))
+        sample = self._reservoir.sample()
+        return sample.iloc[sample_positions(len(sample.index), a, 
+            random_state = self.random_state)]
+
+    def psummary(self, manymissing_ph = 0.70, manymissing_pl = 0.05, nzv_freq_cut = 95/5,
+    nzv_unique_cut = 10, string_threshold = 40):
+        """
+        This function will print you a summary of the dataset with the checks
+        available in streaming mode.
+        It will store the string output and the dictionnary of results in private variables
+        """
+        nacolcount_p = self.nacolcount().Napercentage
+        self._dict_info = {'nb_rows': self._nrow,
+                    'many_missing_percentage': manymissing_ph,
+                    'manymissing_columns': cserie((nacolcount_p > manymissing_ph)),
+                    'low_missing_percentage': manymissing_pl,
+                    'lowmissing_columns': cserie((nacolcount_p > 0 ) & (nacolcount_p <= manymissing_pl)),
+                    'keys_detected': self.detectkey(),
+                    'constant_columns': self.constantcol(),
+                    'nearzerovar_columns' : cserie(self.nearzerovar(nzv_freq_cut,nzv_unique_cut,save_metrics =True).nzv),
+                    'big_strings_col': cserie(self.df_len_string() > string_threshold)
+                    }
+
+        self._string_info = u"""
+there are {nb_rows} rows\n
+the columns with more than {many_missing_percentage:.2%} manymissing values:\n{manymissing_columns} \n
+the columns with less than {low_missing_percentage:.2%}% manymissing values are :\n{lowmissing_columns} \n
+you should fill them with median or most common value\n
+the detected keys of the dataset are:\n{keys_detected} \n
+the constant columns of the dataset are:\n{constant_columns}\n
+the columns with nearzerovariance are:\n{nearzerovar_columns}\n
+these columns contains big strings :\n{big_strings_col}\n
+        """.format(**self._dict_info)
+        print(self._string_info)
+
+
 #########################################################
 # class Hybrid 
 #########################################################
@@ -571,7 +1023,7 @@ class Model(object):
 
 
     def __init__(self,my_array):
-        assert isinstance(my_array, np.my_array)
+        assert isinstance(my_array, np.ndarray)
         if np.isnan(my_array).any(): 
             raise("The array should not have missing value")
         self.my_array = my_array
@@ -591,21 +1043,23 @@ class Model(object):
 
         Return
         -------
-        a skicit-learn object which is a iterator with all the indexes 
+        a list of (train indexes, test indexes) built with the splitters of 
+        sklearn.model_selection, the bootstrap train indexes are drawn with 
+        replacement and the test indexes are the rows never drawn
 
         """
+        n = len(self.my_array)
         if pct_split:
-            self._build = cross_validation.ShuffleSplit(len(self.my_array),
-             n_iter=1,test_size=pct_split)
-        if cv:
-            self._build = cross_validation.KFold(len(self.my_array), n_folds=nb_cv,
-                shuffle = shuffle)
-        if bootstrap:
-            self._build = cross_validation.Bootstrap(len(self.data),n_iter = nb_bootstrap,
-                train_size = bootstrap_pct)
-
+            self._build = list(ShuffleSplit(n_splits = 1, test_size = pct_split).split(self.my_array))
+        if nb_cv:
+            self._build = list(KFold(n_splits = nb_cv, shuffle = shuffle).split(self.my_array))
+        if nb_bootstrap:
+            self._build = []
+            for i in range(nb_bootstrap):
+                train = np.random.randint(n, size = int(bootstrap_pct * n))
+                self._build.append((train, np.setdiff1d(np.arange(n), train)))
         if loocv:
-            self._build = cross_validation.LeaveOneOut(len(self.data))
+            self._build = list(LeaveOneOut().split(self.my_array))
 
         return self._build
 
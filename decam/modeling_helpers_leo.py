@@ -22,12 +22,6 @@ def cserie(serie):
 	return serie[serie].index.tolist()
 
 
-#########################################################
-# Import modules for the Model class 
-#########################################################
-from sklearn import cross_validation
-
-
 #########################################################
 # DataCleaner class
 #########################################################
@@ -595,6 +589,8 @@ class Model(object):
 		a skicit-learn object which is a iterator with all the indexes 
 
 		"""
+		# removed from scikit-learn 0.20, only imported when the indices are built
+		from sklearn import cross_validation
 		if pct_split:
 			self._indices = cross_validation.ShuffleSplit(len(self.my_array),
 			 n_iter=1, test_size=pct_split)
@@ -6,8 +6,13 @@ Purpose : This is a simple experimental class to detect outliers
 
 """
 
+import warnings
+from functools import partial
 import pandas as pd 
 import numpy as np 
+from decam.sketches import QuantileSketch
+from decam.utils import parallel_apply
+from decam.sampling import sample_positions
 
 def cserie(serie):
 	return serie[serie].index.tolist()
@@ -24,6 +29,109 @@ def iqr_score(ndarray):
 def mad_score(ndarray):
 	return (ndarray - np.median(ndarray))/(np.median(np.absolute(ndarray -np.median(ndarray)))/0.6745)
 
+# scores computed for all the columns at once by matrix_scores
+MATRIX_SCORES = [z_score,iqr_score,mad_score]
+
+def column_sketches(x, k = 200, chunksize = 100000, n_jobs = 1, random_state = None):
+	""" Return the list of the QuantileSketch of the columns of the 2-D float 
+	array x : the sketches of the chunks of chunksize rows are built by a pool 
+	of n_jobs threads (-1 for the number of cpus) and merged """
+	def chunk_sketches(i):
+		seed = None if random_state is None else random_state + i
+		chunk = x[i * chunksize:(i + 1) * chunksize]
+		return [QuantileSketch(k, seed).update(chunk[:, j]) for j in range(x.shape[1])]
+	nb_chunks = (x.shape[0] + chunksize - 1) // chunksize
+	results = parallel_apply(dict((i, partial(chunk_sketches, i)) for i in range(nb_chunks)), 
+		n_jobs = n_jobs)
+	sketches = [QuantileSketch(k, random_state) for j in range(x.shape[1])]
+	for i in range(nb_chunks):
+		for sketch, other in zip(sketches, results[i]):
+			sketch.merge(other)
+	return sketches
+
+def sketch_stats(sketches, keys = ['z_score','iqr_score','mad_score']):
+	""" Return a dictionnary of the estimated median, q25, q75 and mad needed 
+	by the scores of keys from the QuantileSketch of each column """
+	stats = {}
+	if 'iqr_score' in keys or 'mad_score' in keys:
+		stats['median'] = np.array([sketch.quantile(0.5) for sketch in sketches])
+	if 'iqr_score' in keys:
+		quartiles = np.array([sketch.quantile([0.25, 0.75]) for sketch in sketches]).reshape(-1, 2)
+		stats['q25'], stats['q75'] = quartiles[:, 0], quartiles[:, 1]
+	if 'mad_score' in keys:
+		stats['mad'] = np.array([sketch.mad(median) for sketch, median in 
+			zip(sketches, stats['median'])])
+	return stats
+
+def column_stats(x, keys = ['z_score','iqr_score','mad_score'], approx = False, 
+	k = 200, n_jobs = 1):
+	""" Return a dictionnary of the statistics of the columns of the 2-D float 
+	array x needed by the scores of keys : mean and std (z_score), median, q25 
+	and q75 (iqr_score), median and mad (mad_score), ignoring the missing values, 
+	each statistic is computed with one call for all the columns.
+
+	If approx is True, the median, q25, q75 and mad are estimated from one 
+	mergeable QuantileSketch of size k per column (built on chunks of rows by 
+	n_jobs threads) instead of sorting the columns, see 
+	decam.sketches.QuantileSketch for the error bounds """
+	stats = {}
+	with warnings.catch_warnings():
+		# all missing columns get missing statistics
+		warnings.simplefilter('ignore', category = RuntimeWarning)
+		if 'z_score' in keys:
+			stats['mean'] = np.nanmean(x, axis = 0)
+			stats['std'] = np.nanstd(x, axis = 0)
+		if approx:
+			stats.update(sketch_stats(column_sketches(x, k, n_jobs = n_jobs), keys))
+			return stats
+		if 'iqr_score' in keys or 'mad_score' in keys:
+			stats['median'] = np.nanmedian(x, axis = 0)
+		if 'iqr_score' in keys:
+			stats['q25'], stats['q75'] = np.nanpercentile(x, [25, 75], axis = 0)
+		if 'mad_score' in keys:
+			stats['mad'] = np.nanmedian(np.absolute(x - stats['median']), axis = 0)
+	return stats
+
+def scores_from_stats(x, stats, keys = ['z_score','iqr_score','mad_score']):
+	""" Return the list of the scores named in keys of the columns of the 2-D 
+	float array x from the statistics of column_stats """
+	res = []
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		for key in keys:
+			if key == 'z_score':
+				res.append((x - stats['mean'])/stats['std'])
+			elif key == 'iqr_score':
+				res.append((x - stats['median'])/(stats['q75'] - stats['q25']))
+			elif key == 'mad_score':
+				res.append((x - stats['median'])/(stats['mad']/0.6745))
+			else:
+				raise ValueError("Unknown score {0}".format(key))
+	return res
+
+def matrix_scores(x, keys = ['z_score','iqr_score','mad_score']):
+	""" Return the list of the scores named in keys (z_score, iqr_score, 
+	mad_score) of all the columns of the 2-D float array x, ignoring the 
+	missing values """
+	return scores_from_stats(x, column_stats(x, keys), keys)
+
+def outlier_frame(x, stats, columns, keys = ['z_score','iqr_score','mad_score'],
+	cutoffs = {'z_score': 3, 'iqr_score': 2, 'mad_score': 2}, index = None):
+	""" Return a DataFrame with for each column of the 2-D float array x the 
+	scores of keys (col_z_score, ...) computed from stats and the flag 
+	col_is_outlier (the absolute value of a score is above its cutoff), 
+	written in one preallocated array """
+	nb_values = len(keys) + 1
+	res = np.empty((x.shape[0], x.shape[1], nb_values), dtype = float)
+	is_outlier = np.zeros(x.shape, dtype = bool)
+	for i, (key, score) in enumerate(zip(keys, scores_from_stats(x, stats, keys))):
+		res[:, :, i] = score
+		with np.errstate(invalid = 'ignore'):
+			is_outlier |= np.absolute(score) >= cutoffs[key]
+	res[:, :, -1] = is_outlier
+	names = [col + '_' + key for col in columns for key in keys + ['is_outlier']]
+	df_outlier = pd.DataFrame(res.reshape(x.shape[0], -1), index = index, columns = names)
+	return df_outlier.astype(dict((col + '_is_outlier', int) for col in columns))
+
 
 class OutliersDetection(object):
 	""" 
@@ -82,21 +190,212 @@ class OutliersDetection(object):
 
 	def outlier_detection_d(self,subset = None,
 	                    scores = [z_score,iqr_score,mad_score],
-	                      cutoff_zscore = 3,cutoff_iqrscore = 2,cutoff_mad = 2):
-	    """ Return a dictionnary with z_score,iqr_score,mad_score as keys and the 
-	    associate dataframe of distance as value of the dictionnnary"""
-	    df = self.data.copy()
-	    numerc_variable = self._dfnum
-	    if subset:
-	        df = df.drop(subset,axis = 1)
-	    df = df.loc[:,numerc_variable] # take only numeric variable 
-	    # if remove_constant_col:
-	    #     df = df.drop(self.constantcol(), axis = 1) # remove constant variable 
-	    df_outlier = pd.DataFrame()
-	    for col in df:
-	        df_temp = self.outlier_detection_serie_d(df[col],scores,cutoff_zscore,
-	            cutoff_iqrscore,cutoff_mad)
-	        df_temp.columns = [col + '_' + col_name for col_name in df_temp.columns]
-	        df_outlier = pd.concat([df_outlier,df_temp],axis = 1)
-	    return df_outlier
+	                      cutoff_zscore = 3,cutoff_iqrscore = 2,cutoff_mad = 2,
+	                      approx = False, k = 200, n_jobs = 1):
+	    """ Return a DataFrame with for each numeric column (except the columns of 
+	    subset) the scores col_z_score, col_iqr_score, col_mad_score and the flag 
+	    col_is_outlier.
+	    If approx is True the median, quartiles and mad are estimated with a 
+	    QuantileSketch of size k per column, built in parallel by n_jobs threads.
+
+	    The z, iqr and mad scores of all the columns are computed at once on a 2-D 
+	    float array (one nanpercentile/nanmedian call per statistic, missing 
+	    values are ignored) and written in one preallocated array. Other score 
+	    functions are applied column by column."""
+	    numeric_variable = [col for col in self._dfnum if not subset or col not in subset]
+	    keys = [str(func.__name__) for func in scores]
+	    if any(func not in MATRIX_SCORES for func in scores):
+	        df_outlier = [self.outlier_detection_serie_d(self.data[col],scores,cutoff_zscore,
+	            cutoff_iqrscore,cutoff_mad).rename(columns = lambda name: col + '_' + name)
+	            for col in numeric_variable]
+	        return pd.concat(df_outlier,axis = 1) if df_outlier else pd.DataFrame()
+	    x = self.data.loc[:,numeric_variable].values.astype(float)
+	    cutoffs = {'z_score': cutoff_zscore, 'iqr_score': cutoff_iqrscore, 'mad_score': cutoff_mad}
+	    stats = column_stats(x, keys, approx = approx, k = k, n_jobs = n_jobs)
+	    return outlier_frame(x, stats, numeric_variable, keys, cutoffs,
+	        index = self.data.index)
+
+	def multivariate_outliers(self, method = 'mcd', subset = None, alpha = 0.025,
+		sample_size = 10000, chunksize = 100000, n_jobs = 1, random_state = 0, **kwargs):
+		""" Score each row on all the numeric columns at once (except the 
+		columns of subset) instead of combining univariate flags.
+
+		The model is fitted on a seeded sample of sample_size rows, then the 
+		rows are scored by chunks of chunksize rows with a pool of n_jobs threads. 
+		The missing values are replaced by the median of the sample, the 
+		constant and all missing columns of the sample are ignored, when no 
+		column is left every row gets a score of 0 and no row is an outlier.
+
+		Arguments
+		---------
+		method : 'mcd' for the squared robust Mahalanobis distance to the 
+		location and covariance of a fast Minimum Covariance Determinant 
+		estimate (sklearn.covariance.MinCovDet), an outlier is above the 
+		1 - alpha quantile of the chi2 distribution, or 'isolation_forest' for 
+		the opposite of the sklearn IsolationForest score (outliers are above 
+		the offset of the forest), kwargs are passed to the sklearn estimator
+		alpha : the false positive rate of the mcd cutoff, default 0.025
+
+		Returns
+		-------
+		a DataFrame indexed like the data with the columns score (the higher 
+		the more anomalous) and is_outlier
+		"""
+		if method not in ('mcd', 'isolation_forest'):
+			raise ValueError("method should be 'mcd' or 'isolation_forest'")
+		columns = [col for col in self._dfnum if not subset or col not in subset]
+		x = self.data.loc[:, columns].values.astype(float)
+		sample = x[sample_positions(len(x), sample_size, random_state = random_state)]
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', category = RuntimeWarning)
+			median = np.nanmedian(sample, axis = 0)
+			keep = ~np.isnan(median) & (np.nanstd(sample, axis = 0) > 0)
+
+		def fill(block):
+			block = block[:, keep]
+			return np.where(np.isnan(block), median[keep], block)
+
+		if not keep.any():
+			return pd.DataFrame({'score': np.zeros(len(x)), 'is_outlier': np.zeros(len(x), dtype = int)},
+				index = self.data.index, columns = ['score', 'is_outlier'])
+		if method == 'mcd':
+			from sklearn.covariance import MinCovDet
+			from scipy.stats import chi2
+			model = MinCovDet(random_state = random_state, **kwargs).fit(fill(sample))
+			score_block = model.mahalanobis
+			cutoff = chi2.ppf(1 - alpha, keep.sum())
+		else:
+			from sklearn.ensemble import IsolationForest
+			model = IsolationForest(random_state = random_state, **kwargs).fit(fill(sample))
+			score_block = lambda block: -model.score_samples(block)
+			cutoff = -model.offset_
+		starts = range(0, len(x), chunksize)
+		scores = parallel_apply(dict((start, partial(lambda start: score_block(
+			fill(x[start:start + chunksize])), start)) for start in starts), n_jobs = n_jobs)
+		score = np.concatenate([scores[start] for start in starts]) if len(x) else np.array([])
+		return pd.DataFrame({'score': score, 'is_outlier': (score > cutoff).astype(int)},
+			index = self.data.index, columns = ['score', 'is_outlier'])
+
+
+class OutlierDetector(object):
+	"""
+	Outlier detector learning the location and scale of each column once (fit) 
+	and scoring new rows or micro batches (transform) with these fitted 
+	statistics, so the cost of scoring is constant per value.
+
+	The scores are the same as OutliersDetection.outlier_detection_d : 
+	z_score (mean, std), iqr_score (median, q25, q75) and mad_score (median, 
+	median absolute deviation), the missing values are ignored.
+	With approx = True, or when fitted by chunks with partial_fit, the median, 
+	quartiles and mad are estimated with a mergeable QuantileSketch per column 
+	and the mean and std with mergeable moments. A detector fitted exactly 
+	keeps no sketches, so it can not be updated by partial_fit or merge.
+
+	Parameters
+	----------
+	columns : list of numeric columns names, default None (the numeric 
+	columns of the fitted data)
+	scores : list of the names of the scores, default all
+	cutoff_zscore, cutoff_iqrscore, cutoff_mad : cutoff of the absolute value 
+	of each score to flag an outlier
+	approx : estimate the robust statistics with sketches, default False
+	k : the size of the QuantileSketch, default 200
+
+	Examples
+	--------
+	* detector = OutlierDetector().fit(train_df)
+	* detector.transform(new_rows) : scores and col_is_outlier flags
+	* detector.stats_ : the fitted statistics per column
+	* for chunk in chunks: detector.partial_fit(chunk)
+	"""
+
+	def __init__(self, columns = None, scores = ['z_score','iqr_score','mad_score'],
+		cutoff_zscore = 3, cutoff_iqrscore = 2, cutoff_mad = 2, approx = False, k = 200):
+		self.columns = None if columns is None else list(columns)
+		self.scores = list(scores)
+		self.cutoffs = {'z_score': cutoff_zscore, 'iqr_score': cutoff_iqrscore, 
+			'mad_score': cutoff_mad}
+		self.approx = approx
+		self.k = k
+		self.stats_ = pd.DataFrame()
+		self._moments = None
+		self._sketches = None
+
+	def _float_array(self, df):
+		return df.loc[:, self.columns].values.astype(float)
+
+	def _set_stats(self, stats):
+		self.stats_ = pd.DataFrame(stats, index = self.columns).T
+
+	def fit(self, df, n_jobs = 1):
+		""" Learn the statistics of the columns of df (with the sketches built 
+		by n_jobs threads if approx) """
+		if self.columns is None:
+			self.columns = cserie((df.dtypes == float)|(df.dtypes == int))
+		x = self._float_array(df)
+		if not self.approx:
+			self._moments, self._sketches = None, None
+			self._set_stats(column_stats(x, self.scores))
+			return self
+		notnull = ~np.isnan(x)
+		count = notnull.sum(axis = 0)
+		mean = np.where(notnull, x, 0).sum(axis = 0)/np.maximum(count, 1)
+		m2 = (np.where(notnull, x - mean, 0) ** 2).sum(axis = 0)
+		self._moments = (count, mean, m2)
+		self._sketches = column_sketches(x, self.k, n_jobs = n_jobs)
+		self._update_stats()
+		return self
+
+	def _check_mergeable(self):
+		if self._sketches is None and len(self.stats_.columns):
+			raise ValueError("The detector was fitted exactly (approx = False), fit it with "
+				"approx = True or partial_fit to update it by chunks")
+
+	def partial_fit(self, df):
+		""" Update the statistics with a chunk of rows df """
+		self._check_mergeable()
+		other = OutlierDetector(self.columns, self.scores, approx = True, k = self.k)
+		return self.merge(other.fit(df))
+
+	def merge(self, other):
+		""" Merge the statistics of another OutlierDetector fitted with 
+		sketches (approx or partial_fit) on other rows """
+		self._check_mergeable()
+		other._check_mergeable()
+		if self._sketches is None:
+			self.columns = other.columns
+			self._moments = other._moments
+			self._sketches = [QuantileSketch(self.k).merge(sketch) for sketch in other._sketches]
+		else:
+			count_a, mean_a, m2_a = self._moments
+			count_b, mean_b, m2_b = other._moments
+			count = count_a + count_b
+			delta = mean_b - mean_a
+			ratio = count_b/np.maximum(count, 1).astype(float)
+			self._moments = (count, mean_a + delta * ratio, m2_a + m2_b + delta ** 2 * count_a * ratio)
+			for sketch, other_sketch in zip(self._sketches, other._sketches):
+				sketch.merge(other_sketch)
+		self._update_stats()
+		return self
+
+	def _update_stats(self):
+		count, mean, m2 = self._moments
+		with np.errstate(divide = 'ignore', invalid = 'ignore'):
+			stats = {'mean': np.where(count > 0, mean, np.nan), 'std': np.sqrt(m2/count)}
+		stats.update(sketch_stats(self._sketches, self.scores))
+		self._set_stats(stats)
+
+	def transform(self, df):
+		""" Return the scores and the col_is_outlier flags of the rows of df """
+		stats = dict((name, values.values) for name, values in self.stats_.iterrows())
+		return outlier_frame(self._float_array(df), stats, self.columns, self.scores,
+			self.cutoffs, index = df.index)
+
+	def fit_transform(self, df):
+		""" fit then transform df """
+		return self.fit(df).transform(df)
 
+	def is_outlier(self, df):
+		""" Return a boolean Series flagging the rows of df with at least one outlier value """
+		flags = self.transform(df).loc[:, [col + '_is_outlier' for col in self.columns]]
+		return flags.any(axis = 1)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+@author: efourrier
+
+Purpose : Fitted preprocessing objects, learning their parameters once on a
+training DataFrame and transforming new batches (scoring) the same way.
+
+"""
+
+import pandas as pd
+import numpy as np
+
+
+class DummyEncoder(object):
+    """
+    One hot encoder of categorical columns learning the levels once, so the
+    training and scoring data get exactly the same dummy columns.
+
+    The dummies are built from the integer codes of the levels, in a dense
+    uint8 DataFrame, a DataFrame of pandas sparse columns or a
+    scipy.sparse CSR matrix, without the dense intermediate of
+    pandas.get_dummies. The levels of a category column are its categories
+    (used or not, like pandas.get_dummies). Unknown levels of new batches get
+    no dummy.
+
+    Parameters
+    ----------
+    columns : list of columns names to encode
+    dummy_na : add a column_nan dummy for the missing values, default True
+
+    Examples
+    --------
+    * encoder = DummyEncoder(columns = ['grade', 'purpose']).fit(train_df)
+    * encoder.transform(score_df) : same output as pd.get_dummies on train_df
+    * encoder.transform(score_df, sparse = True) : with pandas sparse columns
+    * X, names = encoder.transform_csr(score_df) : dummies as a CSR matrix
+    """
+
+    def __init__(self, columns, dummy_na=True):
+        self.columns = list(columns)
+        self.dummy_na = dummy_na
+        self.levels_ = {}
+
+    def fit(self, df):
+        """ Learn the sorted levels (the categories of category columns) of
+        the columns of df """
+        for col in self.columns:
+            if str(df[col].dtype) == 'category':
+                self.levels_[col] = pd.Index(df[col].cat.categories)
+                continue
+            levels = pd.unique(df[col].dropna().values)
+            try:
+                levels = np.sort(levels)
+            except TypeError:
+                # not comparable values are kept in order of appearance
+                pass
+            self.levels_[col] = pd.Index(levels)
+        return self
+
+    def feature_names(self):
+        """ Return the names of the dummy columns """
+        names = []
+        for col in self.columns:
+            names += ['{0}_{1}'.format(col, level) for level in self.levels_[col]]
+            if self.dummy_na:
+                names.append('{0}_nan'.format(col))
+        return names
+
+    def _dummy_positions(self, df):
+        """ Return the rows and the columns of the ones of the dummies of df
+        and the number of dummy columns """
+        nrow = len(df.index)
+        rows, cols = [], []
+        offset = 0
+        for col in self.columns:
+            levels = self.levels_[col]
+            codes = levels.get_indexer(df[col].values)
+            if self.dummy_na:
+                codes[pd.isnull(df[col].values)] = len(levels)
+            present = codes >= 0
+            rows.append(np.arange(nrow)[present])
+            cols.append(codes[present] + offset)
+            offset += len(levels) + (1 if self.dummy_na else 0)
+        rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+        cols = np.concatenate(cols) if cols else np.array([], dtype=int)
+        return rows, cols, offset
+
+    def transform_csr(self, df):
+        """ Return a tuple (scipy.sparse CSR matrix of the dummies, names of
+        the dummy columns) """
+        from scipy import sparse
+        rows, cols, nb_dummies = self._dummy_positions(df)
+        data = np.ones(len(rows), dtype=np.uint8)
+        matrix = sparse.csr_matrix((data, (rows, cols)), shape=(len(df.index), nb_dummies))
+        return matrix, self.feature_names()
+
+    def transform(self, df, sparse=False):
+        """ Return df with the encoded columns replaced by their dummies
+        (added at the end like pandas.get_dummies), as pandas sparse columns
+        if sparse is True """
+        names = self.feature_names()
+        if sparse:
+            matrix, names = self.transform_csr(df)
+            dummies = pd.DataFrame.sparse.from_spmatrix(matrix, index=df.index, columns=names)
+        else:
+            # the ones are written directly in the dense array
+            rows, cols, nb_dummies = self._dummy_positions(df)
+            values = np.zeros((len(df.index), nb_dummies), dtype=np.uint8)
+            values[rows, cols] = 1
+            dummies = pd.DataFrame(values, index=df.index, columns=names)
+        others = [col for col in df.columns if col not in self.columns]
+        return pd.concat([df.loc[:, others], dummies], axis=1, copy=False)
+
+    def fit_transform(self, df, sparse=False):
+        """ fit then transform df """
+        return self.fit(df).transform(df, sparse=sparse)
+
+
+class Imputer(object):
+    """
+    Fitted imputer of missing values : the mean for numeric columns and the
+    most common value for the other columns (like DataCleaner.fillna_serie).
+
+    The fill values are learned once, on the whole data, on a sample or on a
+    stream of chunks (partial_fit, merge), stored in fill_values_ and applied
+    to new DataFrames or chunks. Only the columns with missing values are
+    rewritten, the other columns are not copied.
+
+    Parameters
+    ----------
+    columns : list of columns names to impute, default None (all the columns)
+    fill_values : a dictionnary {column : fill value} if the values are
+    already known, they are kept when the imputer is fitted, default None
+
+    Examples
+    --------
+    * imputer = Imputer(columns = ['income', 'grade']).fit(train_df)
+    * imputer.transform(score_df) : new DataFrame with the missing values filled
+    * for chunk in chunks: imputer.partial_fit(chunk)
+    """
+
+    def __init__(self, columns=None, fill_values=None):
+        self.columns = None if columns is None else list(columns)
+        self._sum = {}
+        self._count = {}
+        self._value_counts = {}
+        self._modes = {}
+        self._fixed_values = dict(fill_values or {})
+        self.fill_values_ = pd.Series(self._fixed_values, dtype=object)
+        if self.columns is None and fill_values:
+            self.columns = list(self.fill_values_.index)
+
+    def _chunk_stats(self, df, columns):
+        other = Imputer(columns=columns)
+        for col in columns:
+            serie = df[col]
+            if (serie.dtype == float) | (serie.dtype == int):
+                other._sum[col] = serie.sum()
+                other._count[col] = serie.count()
+            else:
+                other._value_counts[col] = serie.value_counts()
+        return other
+
+    def partial_fit(self, df):
+        """ Update the statistics with a chunk df and return the imputer """
+        columns = self.columns if self.columns is not None else list(df.columns)
+        return self.merge(self._chunk_stats(df, columns))
+
+    def fit(self, df, sample_size=None, random_state=None, modes=None):
+        """ Learn the fill values on df, or on a random sample of sample_size
+        rows of df. modes is a dictionnary {column : most common value} of the
+        non numeric columns of df if they are already known (for instance
+        from DataCleaner.top_k), these columns are not counted again, but
+        they can not be updated by partial_fit or merge """
+        self._sum, self._count, self._value_counts = {}, {}, {}
+        self._modes = dict(modes or {})
+        if sample_size is not None and sample_size < len(df.index):
+            df = df.sample(n=sample_size, random_state=random_state)
+        columns = self.columns if self.columns is not None else list(df.columns)
+        return self.merge(self._chunk_stats(df, [col for col in columns if col not in self._modes]))
+
+    def merge(self, other):
+        """ Merge the statistics of another Imputer (fitted on other chunks) """
+        conflicts = set(self._modes) & (set(other._value_counts) | set(other._sum))
+        conflicts |= set(other._modes) & (set(self._value_counts) | set(self._sum))
+        if conflicts:
+            raise ValueError("The columns {0} were fitted from their most common value, "
+                             "they can not be updated with other rows".format(sorted(conflicts)))
+        if self.columns is None:
+            self.columns = other.columns
+        for col, value in other._fixed_values.items():
+            self._fixed_values.setdefault(col, value)
+        for col, value in other._modes.items():
+            self._modes.setdefault(col, value)
+        for col in other._sum:
+            self._sum[col] = self._sum.get(col, 0) + other._sum[col]
+            self._count[col] = self._count.get(col, 0) + other._count[col]
+        for col in other._value_counts:
+            if col in self._value_counts:
+                self._value_counts[col] = self._value_counts[col].add(
+                    other._value_counts[col], fill_value=0)
+            else:
+                self._value_counts[col] = other._value_counts[col]
+        self._update_fill_values()
+        return self
+
+    def _update_fill_values(self):
+        values = {}
+        for col in self._sum:
+            if self._count[col]:
+                values[col] = self._sum[col] / float(self._count[col])
+        for col, vc in self._value_counts.items():
+            if len(vc):
+                values[col] = vc.sort_values(ascending=False, kind='mergesort').index[0]
+        values.update(self._modes)
+        # the values given by the user are not learned
+        values.update(self._fixed_values)
+        self.fill_values_ = pd.Series(values, dtype=object)
+
+    def transform(self, df, inplace=False):
+        """ Fill the missing values of df with the learned values, df is
+        modified if inplace is True, else a new DataFrame sharing the
+        untouched columns is returned """
+        if not inplace:
+            df = df.copy(deep=False)
+        for col, value in self.fill_values_.items():
+            if col not in df.columns:
+                continue
+            isnull = df[col].isnull()
+            if isnull.any():
+                df[col] = df[col].where(~isnull, value)
+        return df
+
+    def fit_transform(self, df, inplace=False):
+        """ fit then transform df """
+        return self.fit(df).transform(df, inplace=inplace)
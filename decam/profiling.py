@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+"""
+@author: efourrier
+
+Purpose : Single pass columnar profiling engine used by the DataCleaner class.
+Every column is hashed only once (one value_counts) and the cheap statistics
+(missing values, min, max) are computed in a vectorized way on blocks of columns.
+
+"""
+
+import os
+import copy
+import shutil
+import tempfile
+import hashlib
+from functools import partial
+import pandas as pd
+import numpy as np
+from decam.utils import parallel_apply
+from decam.sketches import HyperLogLog, FrequentItems
+
+
+PROFILE_COLUMNS = ['nb_missing', 'nb_unique_values', 'min', 'max',
+                   'top1_value', 'top1_freq', 'top2_value', 'top2_freq',
+                   'max_len_string', 'is_key']
+
+
+def is_numeric_serie(serie):
+    """ True if the serie is considered numeric by DataCleaner (float or int) """
+    return (serie.dtype == float) | (serie.dtype == int)
+
+
+def value_counts(serie):
+    """ serie.value_counts() without the unused categories of a category
+    column (counted 0 by pandas) """
+    vc = serie.value_counts()
+    if str(serie.dtype) == 'category':
+        vc = vc[vc > 0]
+    return vc
+
+
+def top_k_counts(value_counts, k=2):
+    """ Return a dictionnary {'top1_value', 'top1_freq', ..., 'topk_value',
+    'topk_freq'} from a Series of value counts sorted by decreasing frequency,
+    the values are nan and the frequencies 0 if there are less than k values """
+    res = {}
+    for i in range(k):
+        found = i < len(value_counts)
+        res['top{0}_value'.format(i + 1)] = value_counts.index[i] if found else np.nan
+        res['top{0}_freq'.format(i + 1)] = value_counts.values[i] if found else 0
+    return res
+
+
+def top_k_df(df, k=2):
+    """ Return the k most common values (missing values excluded) of each
+    column of df and their frequencies with a single value_counts per column,
+    as a DataFrame indexed by the columns of df with the columns
+    top1_value, top1_freq, ..., topk_value, topk_freq """
+    columns = []
+    for i in range(k):
+        columns += ['top{0}_value'.format(i + 1), 'top{0}_freq'.format(i + 1)]
+    res = pd.DataFrame(index=df.columns, columns=columns)
+    for col in df.columns:
+        top = top_k_counts(value_counts(df[col]), k=k)
+        for key in top:
+            res.at[col, key] = top[key]
+    for i in range(k):
+        freq = 'top{0}_freq'.format(i + 1)
+        res[freq] = res[freq].astype(int)
+    return res
+
+
+def profile_serie(serie, nrow=None):
+    """ Profile one column with a single hash aggregation.
+
+    Return a dictionnary with the number of distinct values (missing values
+    excluded), the two most common values and their frequencies and the max
+    length of the strings computed on the distinct values only.
+    """
+    if nrow is None:
+        nrow = len(serie)
+    vc = value_counts(serie)
+    nb_unique = len(vc)
+    max_len_string = np.nan
+    if serie.dtype == object and nb_unique > 0:
+        # the length of the strings only depends on the distinct values
+        max_len_string = pd.Series(vc.index, dtype=object).str.len().max()
+    res = {'nb_unique_values': nb_unique,
+           'max_len_string': max_len_string,
+           'is_key': nb_unique == nrow}
+    res.update(top_k_counts(vc, k=2))
+    return res
+
+
+def has_few_levels(serie, max_levels, chunksize=10000):
+    """ Return True if the serie has less than max_levels distinct values
+    (missing values count as a level).
+
+    The distinct values are collected with pandas.unique on chunks of growing
+    size (chunksize, then doubling) and the search stops as soon as max_levels
+    values are found, so long columns with many levels are not fully scanned.
+    For category columns only the integer codes are looked at.
+    """
+    if str(serie.dtype) == 'category':
+        return len(pd.unique(serie.cat.codes.values)) < max_levels
+    values = serie.values
+    uniques = values[:0]
+    start, size = 0, chunksize
+    while start < len(values):
+        uniques = pd.unique(np.concatenate([uniques, pd.unique(values[start:start + size])]))
+        if len(uniques) >= max_levels:
+            return False
+        start += size
+        size *= 2
+    return len(uniques) < max_levels
+
+
+def profile_block(block, nrow):
+    """ Profile a DataFrame block of columns, see profile_df """
+    num_cols = [col for col in block.columns if is_numeric_serie(block[col])]
+    res = pd.DataFrame(index=block.columns, columns=PROFILE_COLUMNS)
+    res['nb_missing'] = block.isnull().sum(axis=0)
+    if num_cols:
+        res.loc[num_cols, 'min'] = block[num_cols].min(axis=0)
+        res.loc[num_cols, 'max'] = block[num_cols].max(axis=0)
+    for col in block.columns:
+        prof = profile_serie(block[col], nrow=nrow)
+        for key in prof:
+            res.at[col, key] = prof[key]
+    return res
+
+
+def profile_df(df, block_size=100, n_jobs=1):
+    """ Profile all the columns of a DataFrame.
+
+    The columns are processed by blocks of block_size columns : the number of
+    missing values and the min/max of numeric columns are computed on the
+    whole block at once, then each column of the block is hashed once.
+
+    Arguments
+    ---------
+    df : a pandas DataFrame
+    block_size : number of columns processed together
+    n_jobs : number of threads profiling the blocks (-1 for the number of cpus)
+
+    Returns
+    -------
+    a pandas DataFrame indexed by the columns of df with the columns
+    nb_missing, nb_unique_values, min, max, top1_value, top1_freq, top2_value,
+    top2_freq, max_len_string, is_key
+    """
+    nrow = len(df.index)
+    blocks = dict((start, df.iloc[:, start:start + block_size])
+                  for start in range(0, len(df.columns), block_size))
+    if not blocks:
+        return pd.DataFrame(columns=PROFILE_COLUMNS)
+    profiles = parallel_apply(dict((start, partial(profile_block, blocks[start], nrow))
+                                   for start in blocks), n_jobs=n_jobs)
+    profile = pd.concat([profiles[start] for start in sorted(profiles)], axis=0)
+    for col in ['nb_missing', 'nb_unique_values', 'top1_freq', 'top2_freq']:
+        profile[col] = profile[col].astype(int)
+    profile['max_len_string'] = profile['max_len_string'].astype(float)
+    profile['is_key'] = profile['is_key'].astype(bool)
+    return profile
+
+
+def merge_dtypes(dtype1, dtype2):
+    """ Return the dtype able to hold the values of two chunks of a column """
+    if dtype1 == dtype2:
+        return dtype1
+    if dtype1.kind in 'biuf' and dtype2.kind in 'biuf':
+        return np.promote_types(dtype1, dtype2)
+    return np.dtype(object)
+
+
+class ProfileAccumulator(object):
+    """
+    Mergeable accumulator of the profile of a DataFrame read by chunks.
+
+    Each chunk is reduced to a partial state (number of missing values,
+    value counts, min, max, max length of strings per column and the
+    distribution of the number of missing values per row), and partial states
+    are merged, so two accumulators fed by different workers can be combined
+    with merge.
+
+    The value counts of a column are exact until the column has more than
+    max_values distinct values, then they are replaced by a HyperLogLog sketch
+    (number of distinct values) and a FrequentItems summary (most common
+    values), so the memory used by a column is bounded whatever the number of
+    rows. A sketched column whose estimated number of distinct values is
+    within 3 standard errors of its number of non missing values is
+    considered a key.
+
+    Parameters
+    ----------
+    max_values : the max number of distinct values counted exactly per
+    column, default 10000
+    error : the relative standard error of the HyperLogLog sketches, default 0.01
+
+    Examples
+    --------
+    * acc = ProfileAccumulator()
+    * for chunk in pd.read_csv(path, chunksize = 100000): acc.update(chunk)
+    * acc.to_profile() : same output as profile_df on the full data (columns
+    with less than max_values distinct values)
+    """
+
+    def __init__(self, max_values=10000, error=0.01):
+        self.max_values = int(max_values)
+        self.error = error
+        self.nrow = 0
+        self.columns = []
+        self.dtypes = {}
+        self._nb_missing = {}
+        self._value_counts = {}
+        self._hll = {}
+        self._frequent = {}
+        self._min = {}
+        self._max = {}
+        self._max_len_string = {}
+        self._row_na = pd.Series([], dtype=int)
+
+    def from_chunk(self, chunk):
+        """ Build the partial state of one chunk (same parameters) """
+        acc = ProfileAccumulator(max_values=self.max_values, error=self.error)
+        acc.nrow = len(chunk.index)
+        acc.columns = list(chunk.columns)
+        isnull = chunk.isnull()
+        acc._row_na = isnull.sum(axis=1).value_counts()
+        nb_missing = isnull.sum(axis=0)
+        for col in acc.columns:
+            serie = chunk[col]
+            acc.dtypes[col] = serie.dtype
+            acc._nb_missing[col] = nb_missing[col]
+            vc = value_counts(serie)
+            acc._value_counts[col] = vc
+            acc._min[col] = np.nan
+            acc._max[col] = np.nan
+            acc._max_len_string[col] = np.nan
+            if is_numeric_serie(serie) and len(vc):
+                acc._min[col] = vc.index.min()
+                acc._max[col] = vc.index.max()
+            if serie.dtype == object and len(vc):
+                acc._max_len_string[col] = pd.Series(vc.index, dtype=object).str.len().max()
+            if len(vc) > self.max_values:
+                acc._sketch(col)
+        return acc
+
+    def _sketch_counts(self, vc):
+        """ Return the HyperLogLog and FrequentItems sketches of value counts """
+        values = np.asarray(vc.index)
+        if values.dtype.kind in 'biuf':
+            # the int and float chunks of a column hash the same way
+            values = values.astype(float)
+        return (HyperLogLog(error=self.error).update(values),
+                FrequentItems(capacity=self.max_values).update_counts(vc))
+
+    def _sketch(self, col):
+        """ Replace the exact value counts of a column by sketches """
+        self._hll[col], self._frequent[col] = self._sketch_counts(self._value_counts.pop(col))
+
+    def is_sketched(self, col):
+        """ True if the value counts of the column are approximated """
+        return col in self._hll
+
+    def update(self, chunk):
+        """ Add a pandas DataFrame chunk to the accumulator """
+        return self.merge(self.from_chunk(chunk))
+
+    def merge(self, other):
+        """ Merge the state of another ProfileAccumulator into this one """
+        if not other.columns:
+            return self
+        if not self.columns:
+            self.columns = list(other.columns)
+        elif self.columns != other.columns:
+            raise ValueError("The chunks should have the same columns")
+
+        def nan_merge(func, a, b):
+            if pd.isnull(a):
+                return b
+            if pd.isnull(b):
+                return a
+            return func(a, b)
+
+        for col in self.columns:
+            if col not in self.dtypes:
+                self.dtypes[col] = other.dtypes[col]
+                self._nb_missing[col] = other._nb_missing[col]
+                if other.is_sketched(col):
+                    self._hll[col] = copy.deepcopy(other._hll[col])
+                    self._frequent[col] = copy.deepcopy(other._frequent[col])
+                else:
+                    self._value_counts[col] = other._value_counts[col]
+                self._min[col] = other._min[col]
+                self._max[col] = other._max[col]
+                self._max_len_string[col] = other._max_len_string[col]
+                continue
+            self.dtypes[col] = merge_dtypes(self.dtypes[col], other.dtypes[col])
+            self._nb_missing[col] += other._nb_missing[col]
+            if not self.is_sketched(col) and not other.is_sketched(col):
+                self._value_counts[col] = self._value_counts[col].add(
+                    other._value_counts[col], fill_value=0)
+                if len(self._value_counts[col]) > self.max_values:
+                    self._sketch(col)
+            else:
+                if not self.is_sketched(col):
+                    self._sketch(col)
+                if other.is_sketched(col):
+                    hll, frequent = other._hll[col], other._frequent[col]
+                else:
+                    hll, frequent = self._sketch_counts(other._value_counts[col])
+                self._hll[col].merge(hll)
+                self._frequent[col].merge(frequent)
+            self._min[col] = nan_merge(min, self._min[col], other._min[col])
+            self._max[col] = nan_merge(max, self._max[col], other._max[col])
+            self._max_len_string[col] = nan_merge(max, self._max_len_string[col],
+                                                  other._max_len_string[col])
+        self._row_na = self._row_na.add(other._row_na, fill_value=0)
+        self.nrow += other.nrow
+        return self
+
+    def empty_frame(self):
+        """ Return an empty DataFrame with the columns and dtypes of the data """
+        return pd.DataFrame(dict((col, pd.Series([], dtype=self.dtypes[col]))
+                                 for col in self.columns), columns=self.columns)
+
+    def narowcount_summary(self):
+        """ Return the number of rows per number of missing values in the row """
+        res = self._row_na.astype(int).sort_index()
+        res.name = 'nb_rows'
+        return res
+
+    def to_profile(self):
+        """ Return the profile of the data seen so far, see profile_df """
+        res = pd.DataFrame(index=self.columns, columns=PROFILE_COLUMNS)
+        for col in self.columns:
+            nb_not_null = self.nrow - self._nb_missing[col]
+            if self.is_sketched(col):
+                hll = self._hll[col]
+                nb_unique = min(hll.count(), nb_not_null)
+                if abs(nb_unique - nb_not_null) <= 3 * hll.error * nb_not_null:
+                    nb_unique = nb_not_null
+                vc = self._frequent[col].top(2)
+            else:
+                vc = self._value_counts[col].sort_values(ascending=False, kind='mergesort')
+                nb_unique = len(vc)
+            res.at[col, 'nb_missing'] = self._nb_missing[col]
+            res.at[col, 'nb_unique_values'] = nb_unique
+            res.at[col, 'min'] = self._min[col]
+            res.at[col, 'max'] = self._max[col]
+            top = top_k_counts(vc.astype(int), k=2)
+            for key in top:
+                res.at[col, key] = top[key]
+            res.at[col, 'max_len_string'] = self._max_len_string[col]
+            res.at[col, 'is_key'] = nb_unique == self.nrow
+        for col in ['nb_missing', 'nb_unique_values', 'top1_freq', 'top2_freq']:
+            res[col] = res[col].astype(int)
+        res['max_len_string'] = res['max_len_string'].astype(float)
+        res['is_key'] = res['is_key'].astype(bool)
+        return res
+
+
+def column_fingerprints(df, chunksize=100000):
+    """ Return a Series with a content fingerprint (md5 hex digest) per column.
+
+    The columns are hashed by chunks of chunksize rows with
+    pandas.util.hash_pandas_object, so no copy or transposition of the full
+    DataFrame is needed. Numeric columns are hashed as float so an int column
+    and a float column with the same values get the same fingerprint.
+    """
+    digests = dict((col, hashlib.md5()) for col in df.columns)
+    for start in range(0, max(len(df.index), 1), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        for i, col in enumerate(df.columns):
+            serie = chunk.iloc[:, i]
+            if serie.dtype.kind in 'biuf':
+                serie = serie.astype(float)
+            digests[col].update(pd.util.hash_pandas_object(serie, index=False).values.tobytes())
+    return pd.Series(dict((col, digests[col].hexdigest()) for col in df.columns),
+                     index=df.columns)
+
+
+def find_duplicated_columns(df, chunksize=100000):
+    """ Find the groups of columns with identical values (missing values are
+    considered equal) in linear time.
+
+    The columns are grouped by fingerprint, then each group is checked with an
+    exact comparison to rule out hash collisions.
+
+    Returns
+    -------
+    a list of list of columns names, one list per group of duplicated columns
+    ordered by the position of the first column of the group
+    """
+    fingerprints = column_fingerprints(df, chunksize=chunksize)
+    groups = []
+    for _, cols in fingerprints.groupby(fingerprints, sort=False):
+        cols = list(cols.index)
+        while len(cols) > 1:
+            first = df[cols[0]]
+            same = [col for col in cols[1:] if
+                    ((df[col] == first) | (df[col].isnull() & first.isnull())).all()]
+            if same:
+                groups.append([cols[0]] + same)
+            cols = [col for col in cols[1:] if col not in same]
+    position = dict((col, i) for i, col in enumerate(df.columns))
+    return sorted(groups, key=lambda group: position[group[0]])
+
+
+def df_fingerprint(df, chunksize=100000):
+    """ Return a fingerprint (md5 hex digest) of the content of a DataFrame :
+    its columns names, dtypes and the fingerprints of its columns """
+    digest = hashlib.md5()
+    digest.update(repr(list(df.columns)).encode('utf-8'))
+    digest.update(repr([str(dtype) for dtype in df.dtypes]).encode('utf-8'))
+    digest.update(repr(len(df.index)).encode('utf-8'))
+    for fingerprint in column_fingerprints(df, chunksize=chunksize):
+        digest.update(fingerprint.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def row_hashes(df, chunksize=100000):
+    """ Return a 64 bits hash (numpy uint64 array) of each row of df, computed
+    by chunks of chunksize rows, equal rows get the same hash """
+    res = np.empty(len(df.index), dtype=np.uint64)
+    for start in range(0, len(df.index), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        res[start:start + len(chunk.index)] = pd.util.hash_pandas_object(chunk, index=False).values
+    return res
+
+
+def row_groups(df):
+    """ Return an integer id per row of df, the same for identical rows
+    (missing values are considered equal), in order of first appearance.
+    The codes of the values of each column are combined column by column """
+    group = np.zeros(len(df.index), dtype=np.int64)
+    for i in range(len(df.columns)):
+        codes, uniques = pd.factorize(df.iloc[:, i])
+        # the missing values get the code -1
+        group = pd.factorize(group * (len(uniques) + 1) + codes + 1)[0].astype(np.int64)
+    return group
+
+
+def _candidates_in_memory(df, chunksize):
+    hashes = row_hashes(df, chunksize=chunksize)
+    positions = np.flatnonzero(pd.Series(hashes).duplicated(keep=False).values)
+    return positions, hashes[positions]
+
+
+def _candidates_partitioned(df, chunksize, partition_dir, nb_partitions):
+    """ Spill the (hash, position) pairs of the rows into nb_partitions files
+    by hash value, then look for repeated hashes one partition at a time """
+    work_dir = tempfile.mkdtemp(dir=partition_dir)
+    try:
+        paths = [(os.path.join(work_dir, 'hashes_{0}.bin'.format(i)),
+                  os.path.join(work_dir, 'positions_{0}.bin'.format(i)))
+                 for i in range(nb_partitions)]
+        for start in range(0, len(df.index), chunksize):
+            hashes = row_hashes(df.iloc[start:start + chunksize], chunksize=chunksize)
+            positions = np.arange(start, start + len(hashes), dtype=np.int64)
+            partitions = (hashes % np.uint64(nb_partitions)).astype(np.int64)
+            for i in np.unique(partitions):
+                in_partition = partitions == i
+                with open(paths[i][0], 'ab') as f:
+                    hashes[in_partition].tofile(f)
+                with open(paths[i][1], 'ab') as f:
+                    positions[in_partition].tofile(f)
+        res_positions, res_hashes = [], []
+        for hashes_path, positions_path in paths:
+            if not os.path.exists(hashes_path):
+                continue
+            hashes = np.fromfile(hashes_path, dtype=np.uint64)
+            positions = np.fromfile(positions_path, dtype=np.int64)
+            repeated = pd.Series(hashes).duplicated(keep=False).values
+            res_positions.append(positions[repeated])
+            res_hashes.append(hashes[repeated])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if not res_positions:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.uint64)
+    positions = np.concatenate(res_positions)
+    hashes = np.concatenate(res_hashes)
+    order = np.argsort(positions, kind='mergesort')
+    return positions[order], hashes[order]
+
+
+def find_duplicated_rows(df, subset=None, chunksize=100000, partition_dir=None,
+                         nb_partitions=16):
+    """ Find the groups of identical rows of df (on the columns of subset if
+    not None, missing values are considered equal).
+
+    The rows are hashed once by chunks, the rows sharing a hash are the
+    candidates, grouped with an exact comparison of their values (row_groups)
+    so rows colliding on a hash are never reported together.
+    If partition_dir is not None the hashes are spilled to nb_partitions files
+    of this directory and the repeated hashes are searched one partition at a
+    time, so the hash table never holds all the rows.
+
+    Returns
+    -------
+    a DataFrame with one row per duplicated row, indexed like df, with the
+    columns position (in df), group (id of the group of identical rows, in
+    order of the position of the first row of the group) and count (size of
+    the group). The rows are sorted by group, then by position in the group
+    """
+    if subset:
+        df = df.loc[:, list(subset)]
+    if partition_dir is None:
+        positions = _candidates_in_memory(df, chunksize)[0]
+    else:
+        positions = _candidates_partitioned(df, chunksize, partition_dir, nb_partitions)[0]
+    group = row_groups(df.iloc[positions])
+    count = np.bincount(group)[group] if len(group) else np.array([], dtype=int)
+    confirmed = count > 1
+    positions, count = positions[confirmed], count[confirmed]
+    group = pd.factorize(group[confirmed])[0]
+    order = np.argsort(group, kind='mergesort')
+    positions, group, count = positions[order], group[order], count[order]
+    return pd.DataFrame({'position': positions, 'group': group, 'count': count},
+                        index=df.index[positions], columns=['position', 'group', 'count'])
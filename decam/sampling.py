@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+@author: efourrier
+
+Purpose : Reproducible sampling of rows, in O(k) memory, for the checks of
+the DataCleaner class, and confidence bounds of the verdicts made on a sample.
+
+"""
+
+import pandas as pd
+import numpy as np
+
+
+def check_random_state(random_state=None):
+    """ Return a numpy RandomState from a seed, a RandomState or None """
+    if isinstance(random_state, np.random.RandomState):
+        return random_state
+    return np.random.RandomState(random_state)
+
+
+def sample_positions(n, k, random_state=None):
+    """ Draw k distinct positions in range(n) uniformly, in a random order, so
+    any prefix of the result is also a uniform sample.
+
+    The positions are drawn with replacement and deduplicated until k distinct
+    positions are found, using O(k) memory instead of a permutation of the n
+    positions (used only when k is more than half of n).
+    """
+    rng = check_random_state(random_state)
+    k = min(int(k), n)
+    if 2 * k > n:
+        return rng.permutation(n)[:k]
+    res = np.array([], dtype=np.int64)
+    while len(res) < k:
+        draws = rng.randint(0, n, size=int(1.1 * (k - len(res))) + 10)
+        res = pd.unique(np.concatenate([res, draws]))
+    return res[:k]
+
+
+def stratified_positions(strata, k, random_state=None):
+    """ Draw about k positions with a proportional allocation per level of
+    strata (an array or a pandas Series, missing values are a level), every
+    level getting at least one position """
+    rng = check_random_state(random_state)
+    # missing values get the code -1, a level like the others
+    codes = pd.factorize(np.asarray(strata))[0]
+    n = len(codes)
+    res = []
+    for code in np.unique(codes):
+        level_positions = np.flatnonzero(codes == code)
+        nb = max(int(round(k * len(level_positions) / float(n))), 1)
+        res.append(level_positions[sample_positions(len(level_positions), nb, rng)])
+    res = np.concatenate(res) if res else np.array([], dtype=np.int64)
+    return res[rng.permutation(len(res))]
+
+
+def miss_rate_bound(k, confidence=0.95):
+    """ Upper bound, at the given confidence level, of the rate of rows with a
+    property none of k uniformly sampled rows has (1 - (1 - confidence)**(1/k),
+    about 3/k at 95%) """
+    if k <= 0:
+        return 1.0
+    return 1 - (1 - confidence) ** (1.0 / k)
+
+
+class Reservoir(object):
+    """
+    Reservoir sample of k rows of a stream of pandas DataFrame chunks : after
+    each update the reservoir is a uniform sample of the rows seen so far.
+
+    Parameters
+    ----------
+    k : the number of rows to keep
+    random_state : a seed or a numpy RandomState, default None
+
+    Examples
+    --------
+    * reservoir = Reservoir(10000, random_state = 0)
+    * for chunk in chunks: reservoir.update(chunk)
+    * reservoir.sample() : DataFrame of the sampled rows
+    """
+
+    def __init__(self, k, random_state=None):
+        self.k = int(k)
+        self.rng = check_random_state(random_state)
+        self.nrow = 0
+        self._rows = None
+        self._labels = None
+
+    def update(self, chunk):
+        """ Add the rows of a chunk to the stream """
+        n = len(chunk.index)
+        if not n:
+            return self
+        seen = self.nrow + np.arange(n)
+        # slot of each row : the first rows fill the reservoir, then the row t
+        # replaces a random slot with probability k / (t + 1)
+        slots = np.where(seen < self.k, seen,
+                         np.floor(self.rng.random_sample(n) * (seen + 1)).astype(np.int64))
+        kept = np.flatnonzero(slots < self.k)
+        # the last row assigned to a slot wins
+        last = pd.Series(kept, index=slots[kept]).groupby(level=0).last()
+        new_rows = chunk.iloc[last.values]
+        new_labels = pd.Series(new_rows.index, index=last.index)
+        new_rows = new_rows.set_axis(last.index, axis=0)
+        if self._rows is None:
+            self._rows, self._labels = new_rows, new_labels
+        else:
+            self._rows = pd.concat([self._rows.drop(last.index, errors='ignore'), new_rows])
+            self._labels = pd.concat([self._labels.drop(last.index, errors='ignore'), new_labels])
+        self.nrow += n
+        return self
+
+    def sample(self):
+        """ Return the sampled rows as a DataFrame with their original index """
+        if self._rows is None:
+            return pd.DataFrame()
+        order = np.argsort(self._rows.index.values, kind='mergesort')
+        res = self._rows.iloc[order]
+        return res.set_axis(self._labels.loc[res.index].values, axis=0)
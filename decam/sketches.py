@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+@author: efourrier
+
+Purpose : Probabilistic sketches used to summarize very big columns with a
+small and mergeable memory footprint.
+
+"""
+
+import pandas as pd
+import numpy as np
+
+
+def hash_values(values):
+    """ Return a 64 bits hash (numpy uint64 array) of the values of an array
+    or a pandas Series, equal values get the same hash.
+    The values are hashed directly (categorize = False) : factorizing them
+    first would build the exact hash table the sketches are meant to avoid """
+    values = np.asarray(values)
+    if values.dtype.kind in 'SU':
+        values = values.astype(object)
+    return pd.util.hash_array(values, categorize=False)
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog sketch to estimate the number of distinct values of a column
+    without building the full hash set of its values.
+
+    The relative standard error of the estimation is 1.04/sqrt(2**p) where
+    2**p is the number of registers (1 byte each), p is deduced from error.
+
+    Parameters
+    ----------
+    error : the target relative standard error, default 0.01 (16384 registers)
+
+    Examples
+    --------
+    * hll = HyperLogLog(error = 0.01)
+    * hll.update(serie.dropna())
+    * hll.count() : estimation of the number of distinct values
+    * hll.merge(other_hll) : union of two sketches with the same error
+    """
+
+    def __init__(self, error=0.01):
+        if not 0 < error < 1:
+            raise ValueError("error should be in ]0,1[")
+        self.p = int(min(max(np.ceil(np.log2((1.04 / error) ** 2)), 4), 18))
+        self.m = 2 ** self.p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    @property
+    def error(self):
+        """ relative standard error of the estimation """
+        return 1.04 / np.sqrt(self.m)
+
+    def update(self, values, chunksize=2 ** 18):
+        """ Add the values of an array or a pandas Series to the sketch, the
+        values are hashed by chunks of chunksize values """
+        values = np.asarray(values)
+        nb_bits = 64 - self.p
+        for start in range(0, len(values), chunksize):
+            hashes = hash_values(values[start:start + chunksize])
+            index = (hashes >> np.uint64(nb_bits)).astype(np.intp)
+            rest = hashes & np.uint64((1 << nb_bits) - 1)
+            # rank of the first 1 bit in the remaining bits : the exponent of
+            # frexp is the bit length of rest (0 for rest = 0)
+            rank = nb_bits + 1 - np.frexp(rest.astype(float))[1]
+            np.maximum.at(self.registers, index, rank.astype(np.uint8))
+        return self
+
+    def merge(self, other):
+        """ Merge another HyperLogLog sketch (same error) into this one """
+        if other.p != self.p:
+            raise ValueError("The sketches should have the same number of registers")
+        self.registers = np.maximum(self.registers, other.registers)
+        return self
+
+    def count(self):
+        """ Return the estimated number of distinct values """
+        m = float(self.m)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(float))
+        nb_zeros = np.sum(self.registers == 0)
+        if estimate <= 2.5 * m and nb_zeros > 0:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * np.log(m / nb_zeros)
+        return int(round(estimate))
+
+
+def count_distinct(values, error=0.01, chunksize=2 ** 18):
+    """ Count the distinct values (missing values excluded) of an array or a
+    pandas Series with a memory bounded by the number of registers of a
+    HyperLogLog sketch of relative standard error error and by chunksize.
+
+    The distinct values are collected exactly with pandas.unique chunk by
+    chunk while there are less of them than registers, so low cardinality
+    columns are counted exactly without any hashing, then the collected
+    values and the remaining chunks are added to the sketch.
+
+    Returns
+    -------
+    a tuple (number of distinct values, relative standard error of the count,
+    0 if it is exact)
+    """
+    values = np.asarray(values)
+    hll = HyperLogLog(error=error)
+    uniques = values[:0]
+    for start in range(0, len(values), chunksize):
+        chunk = values[start:start + chunksize]
+        if chunk.dtype.kind == 'f':
+            chunk = chunk[~np.isnan(chunk)]
+        if uniques is None:
+            # the missing values of object columns are not removed (as costly
+            # as the sketch), they add at most one value to the estimation
+            hll.update(chunk)
+            continue
+        uniques = pd.unique(np.concatenate([uniques, pd.unique(chunk)]))
+        if len(uniques) > hll.m:
+            hll.update(uniques)
+            uniques = None
+    if uniques is not None:
+        return int(np.count_nonzero(~pd.isnull(uniques))), 0.0
+    return hll.count(), hll.error
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch of a numeric column (KLL like compactors with
+    random offsets) to estimate quantiles without sorting the full column.
+
+    The values are kept in levels, a value of the level h standing for 2**h
+    values. When a level holds k values it is sorted and one value out of two
+    (random offset) is promoted to the next level, so the memory is at most
+    about k * log2(n / k) values. Each compaction moves the rank of a query
+    by at most 2**h, with a zero mean, so the normalized rank error of a quantile
+    has a standard deviation below about 1.5/k (0.75% for k = 200), and its
+    absolute value is below 3 standard deviations with high probability.
+    Until the first compaction (less than k values) the quantiles are exact.
+
+    Parameters
+    ----------
+    k : the size of the levels, default 200
+    random_state : seed of the random offsets, default None
+
+    Examples
+    --------
+    * sketch = QuantileSketch(k = 200)
+    * sketch.update(chunk_values) : the missing values are ignored
+    * sketch.quantile([0.25, 0.5, 0.75])
+    * sketch.merge(other_sketch) : sketch of the union (same k)
+    """
+
+    def __init__(self, k=200, random_state=None):
+        if k < 2:
+            raise ValueError("k should be at least 2")
+        self.k = int(k)
+        self.rng = np.random.RandomState(random_state)
+        self.levels = [np.array([], dtype=float)]
+        self.count = 0
+
+    @property
+    def rank_error(self):
+        """ standard deviation of the normalized rank error of a quantile """
+        return 1.5 / self.k
+
+    def update(self, values):
+        """ Add the values of an array or a pandas Series to the sketch """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """ Merge another QuantileSketch (same k) into this one """
+        if other.k != self.k:
+            raise ValueError("The sketches should have the same k")
+        for h, level in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.array([], dtype=float))
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self.count += other.count
+        self._compress()
+        return self
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) >= self.k:
+                level = np.sort(level)
+                if len(level) % 2:
+                    # a random value stays in the level
+                    i = self.rng.randint(len(level))
+                    keep, level = level[i:i + 1], np.delete(level, i)
+                else:
+                    keep = np.array([], dtype=float)
+                promoted = level[self.rng.randint(2)::2]
+                self.levels[h] = keep
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.array([], dtype=float))
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def _weighted_values(self, transform=None):
+        values = np.concatenate(self.levels)
+        if transform is not None:
+            values = transform(values)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h)
+                                  for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='mergesort')
+        return values[order], np.cumsum(weights[order])
+
+    def _quantile(self, q, transform=None):
+        q = np.asarray(q, dtype=float)
+        if not self.count:
+            res = np.full(q.shape, np.nan)
+        elif len(self.levels) == 1:
+            values = self.levels[0] if transform is None else transform(self.levels[0])
+            res = np.percentile(values, 100 * q)
+        else:
+            values, cum_weights = self._weighted_values(transform)
+            index = np.searchsorted(cum_weights, q * cum_weights[-1], side='left')
+            res = values[np.minimum(index, len(values) - 1)]
+        return res if np.ndim(res) else float(res)
+
+    def quantile(self, q):
+        """ Return the estimated quantile(s) q in [0, 1] of the values """
+        return self._quantile(q)
+
+    def mad(self, median=None):
+        """ Return the estimated median absolute deviation of the values (the
+        rank error is at most twice the rank error of a quantile) """
+        if median is None:
+            median = self.quantile(0.5)
+        return self._quantile(0.5, transform=lambda values: np.absolute(values - median))
+
+
+class FrequentItems(object):
+    """
+    Mergeable summary of the most frequent values of a column (Misra-Gries)
+    keeping at most capacity counters whatever the number of distinct values.
+
+    When there are more than capacity values, the (capacity + 1)-th largest
+    count is subtracted from every counter and the values left without count
+    are dropped. The count of a value is underestimated by at most error
+    (below total / (capacity + 1)), so every value more frequent than that is
+    kept.
+
+    Parameters
+    ----------
+    capacity : the max number of counters, default 10000
+
+    Examples
+    --------
+    * summary = FrequentItems(capacity = 10000)
+    * summary.update(chunk_values) : the missing values are ignored
+    * summary.top(2) : Series of the 2 most frequent values and their counts
+    * summary.merge(other_summary) : summary of the union
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = int(capacity)
+        self.counts = pd.Series([], dtype=np.int64)
+        self.count = 0
+        self.error = 0
+
+    def update(self, values):
+        """ Add the values of an array or a pandas Series to the summary """
+        return self.update_counts(pd.Series(values).value_counts())
+
+    def update_counts(self, value_counts):
+        """ Add a Series of counts indexed by the values to the summary """
+        self.count += int(value_counts.sum())
+        self._add(value_counts)
+        return self
+
+    def merge(self, other):
+        """ Merge another FrequentItems summary into this one """
+        self.count += other.count
+        self.error += other.error
+        self._add(other.counts)
+        return self
+
+    def _add(self, value_counts):
+        if len(self.counts):
+            counts = self.counts.add(value_counts, fill_value=0)
+        else:
+            counts = value_counts
+        counts = counts.astype(np.int64)
+        if len(counts) > self.capacity:
+            cut = counts.nlargest(self.capacity + 1).iloc[-1]
+            counts = counts[counts > cut] - cut
+            self.error += cut
+        self.counts = counts
+
+    def top(self, k=None):
+        """ Return the k (default all) most frequent values and their counts
+        (lower bounds) sorted by decreasing count """
+        res = self.counts.sort_values(ascending=False, kind='mergesort')
+        return res if k is None else res.iloc[:k]
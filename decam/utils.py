@@ -9,6 +9,9 @@ import warnings
 from numpy.random import normal
 from numpy.random import choice
 import time 
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool, Pool
+from functools import partial
 import pandas as pd 
 import numpy as np
 
@@ -19,30 +22,150 @@ def common_cols(df1,df2):
     """ Return the intersection of commun columns name """
     return list(set(df1.columns) & set(df2.columns))
 
-def bootstrap_ci(x,n = 300 ,ci = 0.95):
+def _bootstrap_stats(values, stats):
+    """ statistics of each row (resample) of a 2-D array, stats is a list of 
+    'mean', 'median', a quantile in ]0,1[ or a function(array, axis) """
+    res = []
+    for stat in stats:
+        if stat == 'mean':
+            res.append(values.mean(axis = 1))
+        elif stat == 'median':
+            res.append(np.median(values, axis = 1))
+        elif callable(stat):
+            res.append(stat(values, axis = 1))
+        else:
+            res.append(np.percentile(values, 100*stat, axis = 1))
+    return np.array(res)
+
+def bootstrap_distribution(x, n = 300, stats = ['mean'], max_memory = 1e8,
+    random_state = None, n_jobs = 1):
+    """ 
+    Return the bootstrap distribution (array of shape len(stats) x n) of 
+    statistics of a numpy array without missing values.
+
+    The n resamples are drawn by batches using at most about max_memory bytes 
+    each, with one child numpy Generator per batch (seeded from random_state), 
+    so the result does not depend on n_jobs, the number of threads running 
+    the batches (-1 for the number of cpus).
+    """
+    x = np.asarray(x, dtype = float)
+    batch_size = int(max(1, min(n, max_memory // (16 * max(len(x), 1)))))
+    batches = [(start, min(batch_size, n - start)) for start in range(0, n, batch_size)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(batches))
+
+    def run_batch(i):
+        rng = np.random.default_rng(seeds[i])
+        index = rng.integers(0, len(x), size = (batches[i][1], len(x)))
+        return _bootstrap_stats(x[index], stats)
+
+    results = parallel_apply(dict((i, partial(run_batch, i)) for i in range(len(batches))), 
+        n_jobs = n_jobs)
+    return np.concatenate([results[i] for i in range(len(batches))], axis = 1)
+
+def bootstrap_ci(x,n = 300 ,ci = 0.95, stats = 'mean', max_memory = 1e8, 
+    random_state = None, n_jobs = 1):
     """ 
     this is a function depending on numpy to compute bootstrap percentile 
     confidence intervalfor the mean of a numpy array 
 
+    The resamples are drawn by memory bounded batches with seeded numpy 
+    Generators and can be run by a pool of threads, see bootstrap_distribution.
+
     Arguments
     ---------
     x : a numpy ndarray 
     n : the number of boostrap samples 
     ci : the percentage confidence (float) interval in ]0,1[
+    stats : the statistic ('mean', 'median', a quantile in ]0,1[ or a 
+    function(array, axis)) or a list of statistics, default 'mean'
+    max_memory : the max memory in bytes used by a batch of resamples
+    random_state : seed of the resamples, default None
+    n_jobs : the number of threads, -1 to use the number of cpus
 
     Return
     -------
-    a tuple (ci_inf,ci_up)
+    a tuple (ci_inf,ci_up) for one statistic, a DataFrame with the columns 
+    ci_inf and ci_up indexed by the statistics for a list of statistics
     """
 
     low_per = 100*(1 - ci)/2
     high_per = 100*ci + low_per
-    x = removena_numpy(x) 
+    x = removena_numpy(np.asarray(x, dtype = float)) 
+    stats_list = stats if isinstance(stats, list) else [stats]
     if not len(x):
-        return (np.nan,np.nan) 
-    bootstrap_samples = choice(a = x,size = (len(x),n),replace = True).mean(axis = 0)
-    return np.percentile(bootstrap_samples,[low_per,high_per])
+        if not isinstance(stats, list):
+            return (np.nan,np.nan)
+        res = np.full((len(stats_list), 2), np.nan)
+    else:
+        distribution = bootstrap_distribution(x, n, stats_list, max_memory = max_memory, 
+            random_state = random_state, n_jobs = n_jobs)
+        res = np.percentile(distribution, [low_per,high_per], axis = 1).T
+    if not isinstance(stats, list):
+        return res[0]
+    return pd.DataFrame(res, index = [getattr(stat, '__name__', stat) for stat in stats_list], 
+        columns = ['ci_inf', 'ci_up'])
+
+def bootstrap_ci_df(df, n = 300, ci = 0.95, stats = ['mean'], max_memory = 1e8, 
+    random_state = None, n_jobs = 1):
+    """ 
+    Compute bootstrap_ci for each numeric column of a DataFrame, the columns 
+    are run by a pool of n_jobs threads. Each column gets its own seed drawn 
+    from random_state, so the columns are not resampled with the same indices.
+
+    Return
+    -------
+    a DataFrame with the columns ci_inf and ci_up indexed by (column, statistic)
+    """
+    stats = stats if isinstance(stats, list) else [stats]
+    columns = [col for col in df.columns if df[col].dtype.kind in 'biuf']
+    rng = np.random.RandomState(random_state)
+    seeds = dict((col, rng.randint(2**31 - 1)) for col in columns)
+    results = parallel_apply(dict((col, partial(bootstrap_ci, df[col].values, n = n, ci = ci, 
+        stats = stats, max_memory = max_memory, random_state = seeds[col])) for col in columns),
+        n_jobs = n_jobs)
+    if not columns:
+        return pd.DataFrame(columns = ['ci_inf', 'ci_up'])
+    return pd.concat([results[col] for col in columns], keys = columns)
+
+
+def _call(func):
+    return func()
+
+def parallel_apply(funcs, n_jobs = 1, processes = False, initializer = None, initargs = ()):
+    """ 
+    Call the functions without arguments of a dictionnary with a pool of 
+    threads and return the dictionnary of the results.
 
+    Arguments
+    ---------
+    funcs : a dictionnary {key : function without arguments}
+    n_jobs : the number of threads, -1 to use the number of cpus, 1 to call 
+    the functions sequentially in the sorted order of the keys
+    processes : use a pool of processes instead of threads, for the pure 
+    python functions holding the GIL, the functions (functools.partial of 
+    module level functions) and their results are pickled
+    initializer : if not None, initializer(*initargs) is called once by each 
+    worker (or once before the sequential calls), so the large arguments 
+    shared by the functions are pickled once per process and not per function
+
+    Return
+    -------
+    a dictionnary {key : result of the function}
+    """
+    if n_jobs == -1:
+        n_jobs = cpu_count()
+    keys = sorted(funcs)
+    if n_jobs == 1 or len(keys) <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return dict((key, funcs[key]()) for key in keys)
+    pool = (Pool if processes else ThreadPool)(min(n_jobs, len(keys)), initializer, initargs)
+    try:
+        results = pool.map(_call, [funcs[key] for key in keys])
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(keys, results))
 
 
 def clock(func):
@@ -116,6 +239,8 @@ def psi(bench,target,group,print_df = True):
     - bench is a numpy array with the reference variable.
     - target is a numpy array of the new variable.
     - group is the number of group you want consider.
+    To monitor many columns or new batches use decam.drift.DriftMonitor, 
+    which fits the bins once on the benchmark.
     """ 
     labels_q = np.percentile(bench,[(100.0/group)*i for i in range(group + 1)],interpolation = "nearest")
 
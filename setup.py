@@ -16,7 +16,8 @@ setup(name='decam',
       test_suite = 'test',
       keywords=['cleaning','modeling', 'pandas','scikit-learn','prediction'],
       install_requires=[
-          'numpy>=1.7.0',
-          'pandas>=0.15.0',
-          'scikit-learn>=0.14']
+          'numpy>=1.17.0',
+          'pandas>=0.25.0',
+          'scikit-learn>=0.20',
+          'scipy>=1.0.0']
 )
\ No newline at end of file
@@ -13,12 +13,28 @@ The clock decorator in utils will measure the run time of the test
 # Import Packages and helpers
 #########################################################
 
+import io
+import os
+import pickle
 import unittest
+import shutil
+import sys
+import tempfile
 # internal helpers
 from decam.utils import *
-from decam.modeling_helpers import DataCleaner
+from decam.modeling_helpers import DataCleaner, StreamingDataCleaner, Model
+from decam import profiling
+from decam.profiling import find_duplicated_rows
+from decam.sketches import HyperLogLog, QuantileSketch, count_distinct
+from decam.correlation import corr_matrix, recursive_pairwise_elimination
+from decam.cache import DiskCache
+from decam.preprocessing import DummyEncoder, Imputer
+from decam.feature_importance import FeatureImportance, permutation_scores, quantile_bins
+from decam.drift import DriftMonitor, PSIAccumulator
+from decam.outliersdetection import OutliersDetection, OutlierDetector, z_score
 import pandas as pd
 import numpy as np 
+from sklearn.feature_selection import SelectKBest
 
 
 flatten_list = lambda x: [y for l in x for y in flatten_list(l)] if isinstance(x, list) else [x]
@@ -55,6 +71,35 @@ class TestDataCleaner(unittest.TestCase):
         self.assertEqual(len(self._test_dc.sample_df(pct=0.061)),
                          0.061 * float(self._test_dc.data.shape[0]))
 
+    @clock
+    def test_sample_reuse(self):
+        test_dc = DataCleaner(data = create_test_df(), random_state = 1)
+        sample = test_dc.sample_df(nr = 100, pct = 0)
+        self.assertTrue(sample.index.is_unique)
+        self.assertTrue(test_dc.sample_df(nr = 20, pct = 0).equals(sample.iloc[:20]))
+        self.assertTrue(DataCleaner(data = create_test_df(), random_state = 1).sample_df(
+            nr = 100, pct = 0).index.equals(sample.index))
+        stratified = test_dc.sample_df(nr = 70, pct = 0, stratify = 'character_factor')
+        self.assertEqual(set(stratified.character_factor), set(test_dc.data.character_factor))
+
+    @clock
+    def test_sample_checks(self):
+        test_dc = DataCleaner(data = create_test_df())
+        sample_checks = test_dc.sample_checks(k = 100)
+        self.assertEqual(cserie(sample_checks.is_key), test_dc.detectkey())
+        self.assertEqual(cserie(sample_checks.is_constant), test_dc.constantcol())
+        self.assertFalse(sample_checks.full_scan.character_factor)
+        self.assertTrue(sample_checks.full_scan.id)
+        self.assertAlmostEqual(sample_checks.max_other_rate.na_col, 1 - 0.05 ** 0.01)
+        # without the profile the checks use the shared sample and scan the candidates
+        sampled_dc = DataCleaner(data = test_dc.data)
+        test_dc.profile()
+        self.assertEqual(sampled_dc.detectkey(pct = 0.1), test_dc.detectkey())
+        self.assertEqual(sampled_dc.detectkey(dropna = True), test_dc.detectkey(dropna = True))
+        self.assertEqual(sampled_dc.constantcol(nr = 50, pct = 0), test_dc.constantcol())
+        self.assertEqual(len(sampled_dc._profile), 0)
+        self.assertEqual(sampled_dc.findupcol(threshold = 20), test_dc.findupcol(threshold = 1000))
+
     @clock
     def test_nrow(self):
         self.assertEqual(self._test_dc._nrow, self._test_dc.data.shape[0])
@@ -132,6 +177,22 @@ class TestDataCleaner(unittest.TestCase):
         self.assertNotIn('character_variable', factors)
         self.assertIn('character_factor', factors)
 
+    @clock
+    def test_factors_levels(self):
+        test_df = create_test_df()
+        test_df['category_factor'] = test_df.character_factor.astype('category')
+        test_dc = DataCleaner(data = test_df)
+        factors = test_dc.factors(nb_max_levels = 8)
+        self.assertIn('category_factor', factors)
+        self.assertIn('character_factor', factors)
+        self.assertNotIn('character_factor', test_dc.factors(nb_max_levels = 7))
+        self.assertIn('character_variable_fillna', test_dc.factors(nb_max_levels = 5))
+        self.assertNotIn('character_variable_fillna', test_dc.factors(nb_max_levels = 4))
+        profiled_dc = DataCleaner(data = test_df)
+        profiled_dc.profile()
+        self.assertEqual(profiled_dc.factors(nb_max_levels = 8, index = True).tolist(),
+            test_dc.factors(nb_max_levels = 8, index = True).tolist())
+
     @clock
     def test_detectkey_check_col(self):
         detectkey = self._test_dc.detectkey()
@@ -152,6 +213,51 @@ class TestDataCleaner(unittest.TestCase):
         self.assertIn(['id', 'duplicated_column'], findupcol)
         self.assertNotIn('member_id', flatten_list(findupcol))
 
+    @clock
+    def test_findupcol_groups(self):
+        test_df = create_test_df()
+        test_df['id_float'] = test_df.id.astype(float)
+        test_df['na_col_bis'] = np.nan
+        findupcol = DataCleaner(data = test_df).findupcol()
+        self.assertIn(['id', 'duplicated_column', 'id_float'], findupcol)
+        self.assertIn(['na_col', 'na_col_bis'], findupcol)
+        self.assertEqual(len(findupcol), 2)
+
+    @clock
+    def test_finduprow(self):
+        test_df = pd.DataFrame({'a': [1, 2, 1, 3, 2, 1], 'b': ['x', np.nan, 'x', 'y', np.nan, 'z']})
+        test_dc = DataCleaner(data = test_df)
+        finduprow = test_dc.finduprow()
+        self.assertEqual(list(finduprow.index), [0, 2, 1, 4])
+        self.assertEqual(list(finduprow.dup_group), [0, 0, 1, 1])
+        self.assertEqual(list(finduprow.dup_count), [2, 2, 2, 2])
+        self.assertEqual(test_dc.nb_duplicated_rows(), test_df.duplicated().sum())
+        self.assertEqual(list(test_dc.finduprow(subset = ['a']).dup_count), [3, 3, 3, 2, 2])
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            partitioned = find_duplicated_rows(test_df, subset = ['a'], partition_dir = tmp_dir, nb_partitions = 3)
+            self.assertTrue(partitioned.equals(find_duplicated_rows(test_df, subset = ['a'])))
+            self.assertEqual(os.listdir(tmp_dir), [])
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertIsNone(DataCleaner(data = test_df.drop_duplicates()).finduprow())
+
+    def test_finduprow_hash_collision(self):
+        test_df = pd.DataFrame({'a': [1, 2, 1, 3, 2, np.nan, np.nan], 'b': ['x', 'y', 'x', 'y', 'y', 'z', 'z']})
+        row_hashes = profiling.row_hashes
+        # every row gets the same hash
+        profiling.row_hashes = lambda df, chunksize = None: np.zeros(len(df.index), dtype = np.uint64)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for kwargs in [{}, {'partition_dir': tmp_dir, 'nb_partitions': 2}]:
+                duplicated = find_duplicated_rows(test_df, **kwargs)
+                self.assertEqual(list(duplicated.index), [0, 2, 1, 4, 5, 6])
+                self.assertEqual(list(duplicated.group), [0, 0, 1, 1, 2, 2])
+                self.assertEqual(list(duplicated['count']), [2, 2, 2, 2, 2, 2])
+        finally:
+            profiling.row_hashes = row_hashes
+            shutil.rmtree(tmp_dir)
+
     @clock
     def test_clean_df(self):
         basic_cleaning = self._test_dc.basic_cleaning(drop_col='duplicated_column').columns
@@ -167,6 +273,17 @@ class TestDataCleaner(unittest.TestCase):
         self.assertEqual(count_unique.constant_col, 1)
         self.assertEqual(count_unique.num_factor, len(pd.unique(self._test_dc.data.num_factor)))
 
+    @clock
+    def test_count_unique_approx(self):
+        count_unique_approx = self._test_dc.count_unique(approx = True)
+        self.assertIsInstance(count_unique_approx, pd.Series)
+        self.assertEqual(count_unique_approx.id, len(self._test_dc.data.id))
+        self.assertEqual(count_unique_approx.constant_col, 1)
+        self.assertEqual(count_unique_approx.na_col, 0)
+        self.assertEqual(self._test_dc.factors(approx = True), self._test_dc.factors())
+        category = pd.DataFrame({'category': pd.Categorical(['a', 'a', 'b'], categories = ['a', 'b', 'c'])})
+        self.assertEqual(DataCleaner(data = category).count_unique(approx = True).category, 2)
+
     @clock
     def test_structure(self):
         structure = self._test_dc.structure()
@@ -175,6 +292,47 @@ class TestDataCleaner(unittest.TestCase):
         self.assertEqual(len(self._test_dc.data), structure.loc['id', 'nb_unique_values'])
         self.assertTrue(structure.loc['id', 'is_key'])
 
+    @clock
+    def test_profile(self):
+        profile = DataCleaner(data = create_test_df()).profile()
+        self.assertIsInstance(profile, pd.DataFrame)
+        self.assertEqual(list(profile.index), list(self._test_dc.data.columns))
+        self.assertEqual(profile.loc['na_col', 'nb_missing'], 1000)
+        self.assertEqual(profile.loc['character_variable_fillna', 'top1_freq'], 300)
+        self.assertEqual(profile.loc['character_variable_fillna', 'top2_freq'], 200)
+        self.assertEqual(profile.loc['character_variable', 'max_len_string'], 3)
+        self.assertEqual(profile.loc['id', 'max'], 1000)
+        self.assertTrue(profile.loc['id', 'is_key'])
+        self.assertFalse(profile.loc['id_na', 'is_key'])
+
+    @clock
+    def test_profile_unused_categories(self):
+        test_df = pd.DataFrame({'category': pd.Categorical(['a', 'a', 'b'], categories = ['a', 'b', 'c', 'd']),
+            'constant_category': pd.Categorical(['a', 'a', 'a'], categories = ['a', 'b'])})
+        test_dc = DataCleaner(data = test_df)
+        self.assertEqual(test_dc.count_unique().tolist(), [2, 1])
+        self.assertEqual(test_dc.constantcol(), ['constant_category'])
+        self.assertEqual(test_dc.top_k().loc['constant_category', 'top2_freq'], 0)
+
+    @clock
+    def test_top_k(self):
+        test_dc = DataCleaner(data = create_test_df())
+        top_2 = test_dc.top_k()
+        self.assertEqual(top_2.loc['character_variable_fillna', 'top1_value'], 'A')
+        self.assertEqual(top_2.loc['character_variable_fillna', 'top1_freq'], 300)
+        self.assertEqual(top_2.loc['constant_col', 'top2_freq'], 0)
+        self.assertTrue(pd.isnull(top_2.loc['na_col', 'top1_value']))
+        top_3 = test_dc.top_k(k = 3)
+        self.assertEqual(top_3.loc['numeric_variable_fillna', 'top2_freq'], 400)
+        self.assertEqual(top_3.loc['character_variable_fillna', 'top3_freq'], 200)
+        self.assertTrue((top_3.top1_freq == top_2.top1_freq).all())
+
+    @clock
+    def test_df_len_string(self):
+        df_len_string = self._test_dc.df_len_string()
+        self.assertNotIn('id', df_len_string.index)
+        self.assertEqual(df_len_string['constant_col'], len('constant'))
+
     @clock
     def test_nearzerovar(self):
         nearzerovar = self._test_dc.nearzerovar(save_metrics=True)
@@ -183,6 +341,91 @@ class TestDataCleaner(unittest.TestCase):
         self.assertIn('constant_col', cserie(nearzerovar.nzv))
         self.assertIn('na_col', cserie(nearzerovar.nzv))
 
+    @clock
+    def test_findcorr(self):
+        findcorr = self._test_dc.findcorr()
+        self.assertIsInstance(findcorr, list)
+        self.assertEqual(len(set(['id', 'member_id', 'duplicated_column']) - set(findcorr)), 1)
+        self.assertNotIn('outlier', findcorr)
+        # the elimination is run on the cached matrix, so print_mode prints again
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            self._test_dc.findcorr(print_mode = True)
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(len(printed.split()), len(findcorr) + 1)
+
+    @clock
+    def test_psummary_parallel(self):
+        test_df = create_test_df()
+        serial_dc = DataCleaner(data = test_df)
+        parallel_dc = DataCleaner(data = test_df)
+        serial_dc.psummary()
+        parallel_dc.psummary(n_jobs = 4)
+        self.assertEqual(serial_dc._dict_info, parallel_dc._dict_info)
+        self.assertEqual(serial_dc._string_info, parallel_dc._string_info)
+        self.assertIn(['id', 'duplicated_column'], parallel_dc._dict_info['dup_columns'])
+
+    @clock
+    def test_memoization(self):
+        test_dc = DataCleaner(data = create_test_df())
+        structure = test_dc.structure()
+        self.assertTrue(test_dc.structure(threshold_factor = 10).equals(structure))
+        structure_2 = test_dc.structure(threshold_factor = 2)
+        self.assertEqual(structure.loc['num_factor', 'dtypes_r'], 'numeric')
+        self.assertEqual(structure.loc['character_factor', 'dtypes_r'], 'factor')
+        self.assertEqual(structure_2.loc['character_factor', 'dtypes_r'], 'character')
+        detectkey = test_dc.detectkey(dropna = True, pct = 0.1)
+        nb_results = len(test_dc._memo)
+        self.assertEqual(test_dc.detectkey(pct = 0.1, dropna = True), detectkey)
+        self.assertEqual(len(test_dc._memo), nb_results)
+        no_constant_dc = DataCleaner(data = test_dc.data.loc[:, ['id', 'outlier']])
+        self.assertEqual(no_constant_dc.constantcol(), [])
+        self.assertEqual(no_constant_dc.constantcol(), no_constant_dc.constantcol())
+        # the memoized results are copied
+        structure.loc['id', 'is_key'] = False
+        self.assertTrue(test_dc.structure().loc['id', 'is_key'])
+
+    @clock
+    def test_memoization_invalidate(self):
+        test_dc = DataCleaner(data = create_test_df())
+        self.assertEqual(test_dc.nacolcount().loc['numeric_variable_fillna', 'Nanumber'], 200)
+        test_dc.fill_low_na(columns_to_process = ['numeric_variable_fillna'])
+        self.assertEqual(test_dc.nacolcount().loc['numeric_variable_fillna', 'Nanumber'], 0)
+        test_dc.data = test_dc.data.drop('id', axis = 1)
+        self.assertNotIn('id', test_dc.count_unique().index)
+        self.assertEqual(test_dc._ncol, test_dc.data.shape[1])
+        # a new DataFrame of the same shape
+        self.assertIn('constant_col', test_dc.constantcol())
+        test_dc.data = test_dc.data.assign(constant_col = range(len(test_dc.data.index)))
+        self.assertNotIn('constant_col', test_dc.constantcol())
+
+    @clock
+    def test_parallel_apply(self):
+        funcs = dict((i, lambda i = i: i ** 2) for i in range(10))
+        self.assertEqual(parallel_apply(funcs, n_jobs = 3), dict((i, i ** 2) for i in range(10)))
+        self.assertEqual(parallel_apply(funcs), parallel_apply(funcs, n_jobs = -1))
+
+    @clock
+    def test_bootstrap_ci(self):
+        x = np.random.RandomState(0).normal(size = 10000)
+        ci = bootstrap_ci(x, random_state = 1, max_memory = 1e6)
+        self.assertTrue(ci[0] < x.mean() < ci[1])
+        self.assertTrue((ci == bootstrap_ci(x, random_state = 1, max_memory = 1e6, n_jobs = 3)).all())
+        ci_stats = bootstrap_ci(x, stats = ['mean', 'median', 0.9], random_state = 1)
+        self.assertEqual(list(ci_stats.index), ['mean', 'median', 0.9])
+        self.assertTrue(ci_stats.loc[0.9, 'ci_inf'] < np.percentile(x, 90) < ci_stats.loc[0.9, 'ci_up'])
+        self.assertIsInstance(bootstrap_ci(np.array([np.nan])), tuple)
+        self.assertTrue(np.isnan(bootstrap_ci(np.array([np.nan]))).all())
+        ci_df = bootstrap_ci_df(self._test_dc.data, stats = ['mean', 'median'], n = 50)
+        self.assertEqual(len(ci_df.index), 2 * len(self._test_dc._dfnum))
+        same_df = pd.DataFrame({'a': x, 'b': x})
+        same_ci = bootstrap_ci_df(same_df, random_state = 1, max_memory = 1e6)
+        self.assertFalse((same_ci.loc['a'] == same_ci.loc['b']).all().all())
+        self.assertTrue(same_ci.equals(bootstrap_ci_df(same_df, random_state = 1, max_memory = 1e6, n_jobs = 2)))
+
     @clock
     def test_fillna_serie(self):
         test_char_variable = self._test_dc.fillna_serie(self._test_dc.data.character_variable_fillna)
@@ -204,6 +447,7 @@ class TestDataCleaner(unittest.TestCase):
         self.assertTrue((pd.Series(['A']*300 + ['B']*200 + ['C']*200 +['A']*300) == df_fill_low_na_threshold.character_variable_fillna).all())
         self.assertTrue((pd.Series([1]*400 + [3]*400 + [2]*200) == df_fill_low_na_threshold.numeric_variable_fillna).all())
         self.assertTrue(sum(pd.isnull(df_fill_low_na_threshold.many_missing_70)) == 700)
+        self.assertIsInstance(self._test_dc._imputer, Imputer)
 
     @clock
     def test_to_dummy(self):
@@ -216,6 +460,510 @@ class TestDataCleaner(unittest.TestCase):
             self.assertIn('character_variable_fillna_' + e,df_dummy_subset.columns)
         self.assertIn('character_variable_fillna_nan',df_dummy_subset.columns)
 
+    @clock
+    def test_to_dummy_sparse(self):
+        df_dummy = self._test_dc.to_dummy(subset = ['character_factor'], verbose = False)
+        df_dummy_sparse = self._test_dc.to_dummy(subset = ['character_factor'],
+            verbose = False, sparse = True)
+        self.assertEqual(list(df_dummy.columns), list(df_dummy_sparse.columns))
+        self.assertIsInstance(df_dummy_sparse['character_factor_A'].dtype, pd.SparseDtype)
+        self.assertTrue((df_dummy_sparse['character_factor_A'].sparse.to_dense() == df_dummy['character_factor_A']).all())
+        self.assertIsInstance(self._test_dc._dummy_encoder, DummyEncoder)
+
+
+class TestModel(unittest.TestCase):
+
+    @clock
+    def test_build(self):
+        model = Model(np.arange(20.).reshape(10, 2))
+        self.assertEqual([len(test) for train, test in model.build(pct_split = 0.3)], [3])
+        self.assertEqual([len(test) for train, test in model.build(nb_cv = 5)], [2] * 5)
+        self.assertEqual(len(model.build(loocv = True)), 10)
+        for train, test in model.build(nb_bootstrap = 3):
+            self.assertEqual(len(train), 5)
+            self.assertFalse(np.in1d(test, train).any())
+
+
+class TestHyperLogLog(unittest.TestCase):
+
+    @clock
+    def test_count(self):
+        hll = HyperLogLog(error = 0.01).update(np.arange(100000))
+        self.assertAlmostEqual(hll.count(), 100000, delta = 3000)
+        self.assertEqual(HyperLogLog().update(list('AABBC')).count(), 3)
+
+    @clock
+    def test_merge(self):
+        hll1 = HyperLogLog(error = 0.02).update(np.arange(50000))
+        hll2 = HyperLogLog(error = 0.02).update(np.arange(25000, 75000))
+        self.assertAlmostEqual(hll1.merge(hll2).count(), 75000, delta = 4500)
+        self.assertRaises(ValueError, hll1.merge, HyperLogLog(error = 0.1))
+
+    @clock
+    def test_count_distinct(self):
+        values = np.array(['A', 'B', np.nan, 'A'] * 1000, dtype = object)
+        self.assertEqual(count_distinct(values, chunksize = 100), (2, 0.0))
+        count, std_error = count_distinct(np.arange(100000) % 50000, error = 0.02, chunksize = 10000)
+        self.assertEqual(std_error, HyperLogLog(error = 0.02).error)
+        self.assertAlmostEqual(count, 50000, delta = 3000)
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    @clock
+    def test_quantile(self):
+        x = np.random.RandomState(0).normal(size = 200000)
+        sketch = QuantileSketch(k = 200, random_state = 0)
+        for chunk in np.array_split(x, 10):
+            sketch.update(chunk)
+        self.assertEqual(sketch.count, 200000)
+        ranks = np.searchsorted(np.sort(x), sketch.quantile([0.1, 0.25, 0.5, 0.75, 0.9]))/200000.
+        self.assertTrue((np.absolute(ranks - [0.1, 0.25, 0.5, 0.75, 0.9]) < 3 * sketch.rank_error).all())
+        self.assertAlmostEqual(sketch.mad(), np.median(np.absolute(x - np.median(x))), delta = 0.03)
+        self.assertEqual(QuantileSketch().update([3, 1, np.nan, 2]).quantile(0.5), 2)
+
+    @clock
+    def test_merge(self):
+        x = np.random.RandomState(1).uniform(size = 100000)
+        sketch1 = QuantileSketch(k = 100).update(x[:60000])
+        sketch2 = QuantileSketch(k = 100).update(x[60000:])
+        self.assertAlmostEqual(sketch1.merge(sketch2).quantile(0.5), 0.5, delta = 3 * sketch1.rank_error)
+        self.assertEqual(sketch1.count, 100000)
+        self.assertRaises(ValueError, sketch1.merge, QuantileSketch(k = 50))
+
+
+class TestCorrelation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ creating a numeric test data set with missing values """
+        test_df = create_test_df()
+        cls._test_num = test_df[['id', 'id_na', 'num_factor', 'binary_variable',
+            'many_missing_70', 'numeric_variable_fillna', 'outlier']]
+
+    @clock
+    def test_corr_matrix(self):
+        for method in ['pearson', 'spearman']:
+            cor = corr_matrix(self._test_num.dropna(axis = 1), method = method, block_size = 2)
+            self.assertTrue(np.allclose(cor.values, self._test_num.dropna(axis = 1).corr(method = method).values))
+
+    @clock
+    def test_corr_matrix_missing_values(self):
+        cor = corr_matrix(self._test_num, block_size = 3)
+        cor_pandas = self._test_num.corr()
+        self.assertTrue((cor.isnull() == cor_pandas.isnull()).all().all())
+        self.assertTrue(np.allclose(cor.fillna(0).values, cor_pandas.fillna(0).values))
+
+    @clock
+    def test_corr_matrix_columns(self):
+        test_df = create_test_df()
+        test_df['bool_variable'] = test_df.binary_variable == 1
+        columns = ['num_variable', 'outlier', 'bool_variable', 'numeric_variable_fillna']
+        cor = corr_matrix(test_df, columns = columns, block_size = 300)
+        self.assertTrue(np.allclose(cor.values, test_df[columns].astype(float).corr().values, equal_nan = True))
+        # without missing values for spearman (pandas ranks again each pair)
+        columns = columns[:3]
+        cor = corr_matrix(test_df, method = 'spearman', columns = columns, memmap_dir = tempfile.gettempdir())
+        self.assertTrue(np.allclose(cor.values, test_df[columns].astype(float).corr(method = 'spearman').values,
+            equal_nan = True))
+        # the boolean columns are correlated like with DataFrame.corr
+        findcorr = DataCleaner(data = test_df).findcorr(cutoff = 0.99)
+        self.assertEqual(len(set(findcorr) & set(['binary_variable', 'bool_variable'])), 1)
+
+    @clock
+    def test_recursive_pairwise_elimination(self):
+        cor = pd.DataFrame([[1, 0.95, 0.2], [0.95, 1, 0.5], [0.2, 0.5, 1]],
+                           index = list('abc'), columns = list('abc'))
+        self.assertEqual(recursive_pairwise_elimination(cor, cutoff = 0.9), ['b'])
+        self.assertEqual(recursive_pairwise_elimination(cor, cutoff = 0.96), [])
+        self.assertEqual(recursive_pairwise_elimination(-cor, cutoff = 0.9), [])
+        self.assertEqual(recursive_pairwise_elimination(-cor, cutoff = 0.9, absolute = True), ['b'])
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self._cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._cache_dir)
+
+    @clock
+    def test_get_set(self):
+        cache = DiskCache(self._cache_dir)
+        self.assertEqual(cache.get('key'), (False, None))
+        cache.set('key', [1, 2])
+        self.assertEqual(cache.get('key'), (True, [1, 2]))
+
+    @clock
+    def test_evict(self):
+        cache = DiskCache(self._cache_dir, max_size = 1500)
+        cache.set('first', np.zeros(100))
+        cache.set('second', np.zeros(100))
+        self.assertEqual(len(cache.files()), 1)
+        self.assertTrue(cache.get('second')[0])
+        self.assertLessEqual(cache.size(), 1500)
+
+    @clock
+    def test_datacleaner_cache(self):
+        test_df = create_test_df()
+        structure = DataCleaner(data = test_df, cache_dir = self._cache_dir).structure()
+        nb_files = len(DiskCache(self._cache_dir).files())
+        self.assertGreater(nb_files, 0)
+        test_dc = DataCleaner(data = test_df.copy(), cache_dir = self._cache_dir)
+        self.assertTrue(test_dc.structure().equals(structure))
+        self.assertEqual(len(DiskCache(self._cache_dir).files()), nb_files)
+        self.assertNotEqual(test_dc.fingerprint(), DataCleaner(data = create_test_df()).fingerprint())
+        # the execution parameters are not part of the key
+        test_dc.findcorr(block_size = 100)
+        nb_files = len(DiskCache(self._cache_dir).files())
+        DataCleaner(data = test_df, cache_dir = self._cache_dir).findcorr(block_size = 200, print_mode = False)
+        self.assertEqual(len(DiskCache(self._cache_dir).files()), nb_files)
+
+
+class TestDummyEncoder(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_df = create_test_df()
+        cls._encoder = DummyEncoder(columns = ['character_factor', 'character_variable_fillna']).fit(cls._test_df)
+
+    @clock
+    def test_same_as_get_dummies(self):
+        df_dummy = self._encoder.transform(self._test_df)
+        df_get_dummies = pd.get_dummies(self._test_df, dummy_na = True,
+            columns = ['character_factor', 'character_variable_fillna'])
+        self.assertEqual(list(df_dummy.columns), list(df_get_dummies.columns))
+        self.assertTrue((df_dummy.fillna(0) == df_get_dummies.fillna(0)).all().all())
+
+    @clock
+    def test_transform_new_batch(self):
+        new_df = pd.DataFrame({'character_factor': ['A', 'unknown', np.nan],
+            'character_variable_fillna': ['C', 'C', 'B']})
+        matrix, names = self._encoder.transform_csr(new_df)
+        self.assertEqual(matrix.shape, (3, len(names)))
+        self.assertEqual(names, self._encoder.feature_names())
+        dense = pd.DataFrame(matrix.toarray(), columns = names)
+        self.assertEqual(dense.loc[0, 'character_factor_A'], 1)
+        self.assertEqual(dense.loc[1, [name for name in names if name.startswith('character_factor')]].sum(), 0)
+        self.assertEqual(dense.loc[2, 'character_factor_nan'], 1)
+
+    @clock
+    def test_category_levels(self):
+        test_df = pd.DataFrame({'grade': pd.Categorical(['b', 'a', np.nan, 'b'], categories = ['a', 'b', 'c']),
+            'value': [1, 2, 3, 4]})
+        df_dummy = DummyEncoder(columns = ['grade']).fit_transform(test_df)
+        df_get_dummies = pd.get_dummies(test_df, dummy_na = True, columns = ['grade'])
+        self.assertEqual(list(df_dummy.columns), list(df_get_dummies.columns))
+        self.assertTrue((df_dummy.values == df_get_dummies.values).all())
+
+
+class TestImputer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_df = create_test_df()
+        cls._columns = ['character_variable_fillna', 'numeric_variable_fillna']
+
+    @clock
+    def test_same_as_fillna_serie(self):
+        imputer = Imputer(columns = self._columns).fit(self._test_df)
+        df_filled = imputer.transform(self._test_df)
+        self.assertTrue(self._test_df.numeric_variable_fillna.isnull().any())
+        for col in self._columns:
+            self.assertTrue((df_filled[col] == DataCleaner.fillna_serie(self._test_df[col])).all())
+        self.assertTrue(df_filled.index.equals(self._test_df.index))
+
+    @clock
+    def test_partial_fit(self):
+        imputer = Imputer(columns = self._columns).fit(self._test_df)
+        streamed = Imputer(columns = self._columns)
+        for start in range(0, len(self._test_df.index), 300):
+            streamed.partial_fit(self._test_df.iloc[start:start + 300])
+        self.assertEqual(streamed.fill_values_.character_variable_fillna, 'A')
+        self.assertAlmostEqual(streamed.fill_values_.numeric_variable_fillna,
+            imputer.fill_values_.numeric_variable_fillna)
+        chunk = self._test_df.iloc[600:800]
+        filled = streamed.transform(chunk)
+        self.assertTrue(filled.loc[:, self._columns].notnull().all().all())
+        self.assertTrue(chunk.loc[:, self._columns].isnull().any().any())
+
+    @clock
+    def test_fill_values_kept(self):
+        imputer = Imputer(columns = self._columns, fill_values = {'numeric_variable_fillna': -1})
+        imputer.partial_fit(self._test_df)
+        self.assertEqual(imputer.fill_values_.numeric_variable_fillna, -1)
+        self.assertEqual(imputer.fill_values_.character_variable_fillna, 'A')
+
+    @clock
+    def test_modes(self):
+        test_dc = DataCleaner(data = self._test_df.copy())
+        imputer = test_dc.imputer(self._columns)
+        self.assertEqual(imputer._modes, {'character_variable_fillna': 'A'})
+        self.assertEqual(list(imputer._value_counts), [])
+        self.assertTrue(imputer.fill_values_.equals(Imputer(columns = self._columns).fit(self._test_df).fill_values_))
+        self.assertRaises(ValueError, imputer.partial_fit, self._test_df)
+
+
+class TestOutliersDetection(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_od = OutliersDetection(data = create_test_df())
+
+    @clock
+    def test_outlier_detection_d(self):
+        df_outlier = self._test_od.outlier_detection_d()
+        serie_outlier = self._test_od.outlier_detection_serie_d(self._test_od.data.outlier)
+        self.assertEqual(len(df_outlier.columns), 4 * len(self._test_od._dfnum))
+        for col in serie_outlier.columns:
+            self.assertTrue(np.allclose(df_outlier['outlier_' + col], serie_outlier[col], equal_nan = True))
+        self.assertEqual(df_outlier.outlier_is_outlier.dtype, int)
+        self.assertEqual(self._test_od.outlier_detection_d(subset = ['outlier'], 
+            scores = [z_score]).shape, (1000, 2 * (len(self._test_od._dfnum) - 1)))
+
+    @clock
+    def test_fitted_detector(self):
+        detector = OutlierDetector().fit(self._test_od.data)
+        self.assertEqual(detector.columns, self._test_od._dfnum)
+        df_outlier = detector.transform(self._test_od.data)
+        self.assertTrue(df_outlier.equals(self._test_od.outlier_detection_d()))
+        batch = self._test_od.data.iloc[[3, 10, 100, 998]]
+        self.assertTrue(detector.transform(batch).equals(df_outlier.iloc[[3, 10, 100, 998]]))
+        self.assertTrue(detector.is_outlier(batch).loc[[10, 100]].all())
+        outlier_detector = OutlierDetector(columns = ['outlier'], scores = ['z_score'],
+            cutoff_zscore = 4).fit(self._test_od.data)
+        # the other values are random normal, one of them can rarely be above the cutoff
+        self.assertTrue(set([1, 10, 100]) <= set(cserie(outlier_detector.is_outlier(self._test_od.data))))
+
+    @clock
+    def test_approx_detector(self):
+        exact = OutlierDetector().fit(self._test_od.data)
+        approx = OutlierDetector(approx = True).fit(self._test_od.data, n_jobs = 2)
+        streamed = OutlierDetector()
+        for start in range(0, 1000, 150):
+            streamed.partial_fit(self._test_od.data.iloc[start:start + 150])
+        self.assertTrue(np.allclose(approx.stats_.loc[['mean', 'std']], exact.stats_.loc[['mean', 'std']], equal_nan = True))
+        self.assertTrue(np.allclose(streamed.stats_.loc[['mean', 'std']], exact.stats_.loc[['mean', 'std']], equal_nan = True))
+        self.assertAlmostEqual(streamed.stats_.outlier['median'], exact.stats_.outlier['median'], delta = 0.1)
+        two_chunks = OutlierDetector(approx = True).fit(self._test_od.data.iloc[:500])
+        two_chunks.partial_fit(self._test_od.data.iloc[500:])
+        self.assertTrue(np.allclose(two_chunks.stats_.loc[['mean', 'std']], exact.stats_.loc[['mean', 'std']], equal_nan = True))
+        self.assertAlmostEqual(two_chunks.stats_.outlier['median'], exact.stats_.outlier['median'], delta = 0.1)
+        exact_chunk = OutlierDetector().fit(self._test_od.data.iloc[:500])
+        self.assertRaises(ValueError, exact_chunk.partial_fit, self._test_od.data.iloc[500:])
+        self.assertRaises(ValueError, two_chunks.merge, exact_chunk)
+        self.assertEqual(self._test_od.outlier_detection_d(approx = True).shape, (1000, 4 * len(self._test_od._dfnum)))
+
+    @clock
+    def test_multivariate_outliers(self):
+        x = np.random.RandomState(0).multivariate_normal([0, 0], [[1, 0.9], [0.9, 1]], size = 2000)
+        x[:5] = [1.5, -1.5] # outliers only when the two columns are considered together
+        test_df = pd.DataFrame(x, columns = ['a', 'b'])
+        test_df['constant_col'] = 1
+        test_od = OutliersDetection(data = test_df)
+        mcd = test_od.multivariate_outliers(sample_size = 1000, chunksize = 300, n_jobs = 2)
+        self.assertEqual(list(mcd.columns), ['score', 'is_outlier'])
+        self.assertTrue(mcd.is_outlier.iloc[:5].all())
+        self.assertLess(mcd.is_outlier.mean(), 0.1)
+        forest = test_od.multivariate_outliers(method = 'isolation_forest', contamination = 0.01)
+        self.assertTrue((forest.score.iloc[:5] > forest.score.median()).all())
+        self.assertRaises(ValueError, test_od.multivariate_outliers, method = 'unknown')
+        for method in ['mcd', 'isolation_forest']:
+            constant = test_od.multivariate_outliers(method = method, subset = ['a', 'b'])
+            self.assertEqual(constant.shape, (2000, 2))
+            self.assertEqual(constant.score.abs().sum(), 0)
+            self.assertEqual(constant.is_outlier.sum(), 0)
+
+
+class TestDriftMonitor(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.RandomState(0)
+        cls._bench = pd.DataFrame({'num': rng.normal(size = 5000), 'char': rng.choice(list('xyz'), 5000)})
+        cls._target = pd.DataFrame({'num': rng.normal(0.3, size = 3000).clip(-3, 3),
+            'char': rng.choice(list('xyzw'), 3000)})
+        cls._monitor = DriftMonitor(group = 10).fit(cls._bench)
+
+    @clock
+    def test_same_as_psi(self):
+        target = self._target.num.clip(self._bench.num.min(), self._bench.num.max())
+        psi_monitor = DriftMonitor(group = 10, columns = ['num'], smoothing = 0).fit(self._bench).psi(
+            pd.DataFrame({'num': target}))
+        self.assertAlmostEqual(psi_monitor.num, psi(self._bench.num.values, target.values, 10, print_df = False))
+
+    @clock
+    def test_psi(self):
+        psi_serie = self._monitor.psi(self._target)
+        self.assertEqual(list(psi_serie.index), ['num', 'char'])
+        self.assertTrue(np.isfinite(psi_serie).all())
+        self.assertGreater(psi_serie.char, 0.1)
+        chunks = [self._target.iloc[start:start + 700] for start in range(0, 3000, 700)]
+        self.assertTrue(np.allclose(self._monitor.psi(chunks), psi_serie))
+        self.assertAlmostEqual(self._monitor.psi(self._bench).sum(), 0)
+        report = self._monitor.report(self._target, 'char')
+        self.assertEqual(list(report.index), ['x', 'y', 'z', 'other', 'missing'])
+        self.assertAlmostEqual(report.target_pct.other, (self._target.char == 'w').mean())
+
+    @clock
+    def test_accumulator(self):
+        accumulator1 = self._monitor.accumulator()
+        accumulator2 = PSIAccumulator(pickle.loads(pickle.dumps(self._monitor)))
+        for start in range(0, 3000, 500):
+            (accumulator1 if start < 1500 else accumulator2).update(self._target.iloc[start:start + 500])
+        accumulator1.merge(pickle.loads(pickle.dumps(accumulator2)))
+        self.assertEqual(accumulator1.nrow, 3000)
+        self.assertTrue(np.allclose(accumulator1.psi(), self._monitor.psi(self._target)))
+        other_monitor = DriftMonitor(group = 5).fit(self._bench)
+        self.assertRaises(ValueError, accumulator1.merge, other_monitor.accumulator())
+        self.assertEqual(accumulator1.reset().nrow, 0)
+
+
+class TestFeatureImportance(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.RandomState(0)
+        cls._test_df = pd.DataFrame(rng.normal(size = (200, 4)), columns = ['a', 'b', 'c', 'd'])
+        cls._test_df['a_bis'] = cls._test_df.a + rng.normal(scale = 0.01, size = 200)
+        cls._test_y = (cls._test_df.a + 0.5 * cls._test_df.b > 0).astype(int)
+
+    @clock
+    def test_summary(self):
+        fi = FeatureImportance(self._test_df, self._test_y, n_jobs = 2, random_state = 0)
+        summary = fi.summary(n_jobs = 2)
+        self.assertEqual(list(summary.columns), ['Predictors', 'RF', 'Boosting', 'KBest', 'RPE'])
+        self.assertEqual(len(fi._models), 4)
+        self.assertEqual(fi._rf_model.n_jobs, 1) # fitted in a pool of processes
+        self.assertEqual(summary.RPE.sum(), 4) # a or a_bis is removed
+        self.assertTrue(summary.RPE.iloc[1:4].all())
+        models = dict(fi._models)
+        self.assertTrue(fi.summary().equals(summary))
+        self.assertTrue(all(fi._models[key] is models[key] for key in models))
+        self.assertEqual(fi.rf(n_estimators = 10).RF.max(), 1)
+        self.assertEqual(fi._rf_model.n_jobs, 2)
+        self.assertEqual(len(fi._models), 5)
+
+    @clock
+    def test_max_models(self):
+        fi = FeatureImportance(self._test_df, self._test_y, random_state = 0, max_models = 2)
+        for n_estimators in [3, 4, 5]:
+            fi.rf(n_estimators = n_estimators)
+        self.assertEqual([key[1] for key in fi._models], [4, 5])
+        fi.rf(n_estimators = 4)
+        fi.kbest()
+        self.assertEqual([key[0] for key in fi._models], ['rf', 'kbest'])
+        self.assertEqual(list(fi._models)[0][1], 4)
+
+    @clock
+    def test_fast_boosting(self):
+        fi = FeatureImportance(self._test_df, self._test_y, random_state = 0)
+        boosting = fi.boosting(n_estimators = 200, fast = True, sample_size = 150, n_subsamples = 3, n_jobs = 2)
+        self.assertEqual(list(boosting.columns), ['Predictors', 'Boosting', 'Boosting_std'])
+        self.assertEqual(len(fi._boosting_model), 3)
+        self.assertTrue(all(model.n_estimators_ <= 200 for model in fi._boosting_model))
+        self.assertEqual(boosting.Boosting.max(), 1)
+        self.assertTrue(-1 <= fi._boosting_stability <= 1)
+        self.assertIn(boosting.Predictors[boosting.Boosting.idxmax()], ['a', 'a_bis'])
+
+    @clock
+    def test_quantile_bins(self):
+        test_df = pd.DataFrame({'a': [1., 2., np.nan, 4., 100.], 'b': [np.nan] * 5})
+        bins = quantile_bins(test_df, max_bins = 4)
+        self.assertEqual(list(bins[:, 0]), [0, 1, 4, 2, 3]) # 3 edges, 100 in the last bin
+        self.assertEqual(list(bins[:, 1]), [1] * 5)
+
+    @clock
+    def test_permutation_importance(self):
+        fi = FeatureImportance(self._test_df, self._test_y, random_state = 0, holdout = 0.3)
+        self.assertEqual(len(fi._holdout_df.index), 60)
+        self.assertEqual(len(fi._train_df.index), 140)
+        fi.rf(n_estimators = 20)
+        importance = fi.permutation_importance(n_repeats = 3, n_jobs = 2)
+        self.assertEqual(list(importance.columns), ['Predictors', 'Permutation', 'Permutation_std'])
+        self.assertEqual(fi._permutation_scores.shape, (3, 5))
+        self.assertIn(importance.Predictors[importance.Permutation.idxmax()], ['a', 'a_bis'])
+        self.assertEqual(len(fi._models), 2)
+        # the rf model stays fitted on all the rows, a copy is fitted for the permutation
+        permutation_model = list(fi._models.values())[-1]
+        self.assertIsNot(permutation_model, fi._rf_model)
+        self.assertEqual(permutation_model.n_estimators, 20)
+        kbest = SelectKBest(k = 'all').fit(self._test_df, self._test_y)
+        np.testing.assert_allclose(fi.kbest().KBest.astype(float), kbest.scores_)
+        self.assertTrue(fi.permutation_importance(n_repeats = 3).equals(importance))
+        self.assertEqual(len(fi._models), 3) # the permutation model is reused
+        # the buffer is restored after each column
+        x = fi._holdout_df.values.astype(float)
+        scores = permutation_scores(permutation_model, x, fi._holdout_resp, random_state = 0)
+        self.assertTrue((x == fi._holdout_df.values).all())
+        np.testing.assert_allclose(scores, permutation_scores(permutation_model, x, fi._holdout_resp, random_state = 0))
+        fi.boosting(n_estimators = 20, fast = True, sample_size = 150, n_subsamples = 2)
+        with self.assertRaises(ValueError):
+            fi.permutation_importance(model = 'boosting')
+
+
+class TestStreamingDataCleaner(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ creating the same test data set in memory and by chunks """
+        test_df = create_test_df()
+        cls._test_dc = DataCleaner(data = test_df)
+        cls._test_sdc = DataCleaner.from_chunks(test_df.iloc[i:i + 150] for i in range(0, 1000, 150))
+
+    @clock
+    def test_from_chunks(self):
+        self.assertIsInstance(self._test_sdc, StreamingDataCleaner)
+        self.assertEqual(self._test_sdc._nrow, 1000)
+        self.assertEqual(self._test_sdc._dfnum, self._test_dc._dfnum)
+
+    @clock
+    def test_same_results_as_memory(self):
+        self.assertTrue(self._test_sdc.nacolcount().equals(self._test_dc.nacolcount()))
+        self.assertTrue(self._test_sdc.count_unique().equals(self._test_dc.count_unique()))
+        self.assertTrue(self._test_sdc.narowcount_summary().equals(self._test_dc.narowcount_summary()))
+        self.assertEqual(self._test_sdc.constantcol(), self._test_dc.constantcol())
+        self.assertEqual(self._test_sdc.manymissing(0.7), self._test_dc.manymissing(0.7))
+        self.assertEqual(self._test_sdc.detectkey(), self._test_dc.detectkey())
+
+    @clock
+    def test_not_streamable(self):
+        self.assertFalse(hasattr(self._test_sdc, 'findcorr'))
+        self.assertFalse(hasattr(self._test_sdc, 'finduprow'))
+        self.assertRaises(ValueError, self._test_sdc.top_k, 3)
+
+    @clock
+    def test_bounded_value_counts(self):
+        test_df = create_test_df()
+        test_sdc = StreamingDataCleaner((test_df.iloc[i:i + 150] for i in range(0, 1000, 150)),
+            max_values = 100)
+        test_dc = DataCleaner(data = test_df)
+        self.assertTrue(test_sdc.is_sketched('id'))
+        self.assertFalse(test_sdc.is_sketched('character_factor'))
+        self.assertLessEqual(len(test_sdc._accumulator._frequent['id'].counts), 100)
+        # the sketched columns with about as many distinct values as rows are keys
+        self.assertIn('id', test_sdc.detectkey())
+        self.assertIn('member_id', test_sdc.detectkey())
+        self.assertAlmostEqual(test_sdc.count_unique()['num_variable'], 
+            test_dc.count_unique()['num_variable'], delta = 50)
+        self.assertEqual(test_sdc.constantcol(), test_dc.constantcol())
+        self.assertEqual(test_sdc.factors(), test_dc.factors())
+        self.assertEqual(test_sdc.top_k().loc['character_factor'].tolist(),
+            test_dc.top_k().loc['character_factor'].tolist())
+        # the frequencies of the sketched columns are lower bounds
+        sketched = [col for col in test_df.columns if test_sdc.is_sketched(col)]
+        self.assertTrue((test_sdc.top_k().loc[sketched, 'top1_freq'] <= test_dc.top_k().loc[sketched, 'top1_freq']).all())
+
+    @clock
+    def test_reservoir_sample(self):
+        sample = self._test_sdc.sample_df(pct = 0.05)
+        self.assertEqual(len(sample.index), 50)
+        self.assertTrue(sample.index.is_unique)
+        self.assertTrue(sample.equals(self._test_dc.data.loc[sample.index]))
+        self.assertTrue(sample.equals(self._test_sdc.sample_df(pct = 0.05)))
+
+
 
 
 